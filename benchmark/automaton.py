@@ -0,0 +1,50 @@
+""" Benchmark of checking lines against a wide expectation tree, interpreted
+  and compiled.
+
+  The tree is an AllOf of two step Sequences spread over several processes,
+  and none of the lines received match. The interpreted tree visits every
+  Sequence on each line while the compiled tree only checks the leaves
+  waiting on the process of the line.
+
+  Usage: python automaton.py [leaves ...]
+"""
+import os
+import sys
+import time
+import logging
+
+# Configure the path so that the test framework will be found
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import xmos.test.base as base
+import xmos.test.master as master
+import xmos.test.process as process
+from xmos.test.base import AllOf, Expected, Sequence
+
+PROCESSES = 8
+LINES = 200
+
+def run(leaves, compile):
+  base.activeProcesses.clear()
+  m = master.Master(compile=compile)
+  names = ['ep%d' % n for n in range(PROCESSES)]
+  processes = [process.Process(name, m) for name in names]
+
+  m.expect(AllOf([Sequence([Expected(names[n % PROCESSES], "never %d$" % n),
+                            Expected(names[(n + 1) % PROCESSES], "step")])
+                  for n in range(leaves)]))
+
+  start = time.time()
+  for n in range(LINES):
+    processes[n % PROCESSES].errReceived("noise line %d\n" % n)
+  return time.time() - start
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.WARNING)
+  sizes = [int(n) for n in sys.argv[1:]] or [250, 500, 1000, 2000, 4000]
+
+  print "%10s %14s %14s" % ("leaves", "us/line", "compiled")
+  for leaves in sizes:
+    interpreted = run(leaves, False)
+    compiled = run(leaves, True)
+    print "%10d %14.2f %14.2f" % (leaves, interpreted * 1e6 / LINES, compiled * 1e6 / LINES)
@@ -0,0 +1,48 @@
+""" Benchmark of Master.checkAgainstHistory as the output history grows.
+
+  One process has a long history of lines which never match while another
+  process completes the expected one line at a time. Every partial match
+  causes the history to be checked again, so this should scale linearly
+  with the length of the history.
+
+  Usage: python history.py [lines ...]
+"""
+import os
+import sys
+import time
+import logging
+
+# Configure the path so that the test framework will be found
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import xmos.test.base as base
+import xmos.test.master as master
+import xmos.test.process as process
+from xmos.test.base import AllOf, Expected
+
+MATCHES = 200
+
+def run(lines):
+  base.activeProcesses.clear()
+  m = master.Master()
+  ep0 = process.Process('ep0', m)
+  ep1 = process.Process('ep1', m)
+
+  for n in range(lines):
+    ep1.errReceived("noise line %d\n" % n)
+
+  start = time.time()
+  m.expect(AllOf([Expected('ep0', "step %d$" % n) for n in range(MATCHES)] +
+                 [Expected('ep1', "never seen")]))
+  for n in range(MATCHES):
+    ep0.errReceived("step %d\n" % n)
+  return time.time() - start
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.WARNING)
+  sizes = [int(n) for n in sys.argv[1:]] or [1000, 2000, 4000, 8000, 16000]
+
+  print "%10s %10s %14s" % ("lines", "seconds", "us/line")
+  for lines in sizes:
+    elapsed = run(lines)
+    print "%10d %10.3f %14.2f" % (lines, elapsed, elapsed * 1e6 / lines)
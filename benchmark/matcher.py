@@ -0,0 +1,93 @@
+""" Benchmark of finding the patterns that match each line, searching for
+  each pattern in turn, with the patterns combined into lookaheads as the
+  matcher first did, and with the PatternMatcher.
+
+  The patterns wait on samples from different channels, half as regular
+  expressions and half as plain strings, and one line in MATCHING matches
+  one of them, so most lines are ruled out by the single search of the
+  PatternMatcher.
+
+  Usage: python matcher.py [patterns ...]
+"""
+import os
+import re
+import sys
+import time
+
+# Configure the path so that the test framework will be found
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from xmos.test.base import compilePattern
+from xmos.test.matcher import PatternMatcher, getSource
+
+LINES = 2000
+MATCHING = 10
+
+def makePattern(i):
+  if i % 2:
+    return compilePattern('ep%d: channel %d: sample lost' % (i % 4, i))
+  return compilePattern(r'^ep%d: channel %d: sample \d+ (?:ok|late)$' % (i % 4, i))
+
+def makePatterns(n):
+  return [makePattern(i) for i in range(n)]
+
+def makeLines(n):
+  lines = []
+  for i in range(LINES):
+    channel = i % n
+    if i % MATCHING:
+      lines.append('ep%d: channel %d: sample %d dropped' % (i % 4, channel, i))
+    elif channel % 2:
+      lines.append('ep%d: channel %d: sample lost' % (channel % 4, channel))
+    else:
+      lines.append('ep%d: channel %d: sample %d ok' % (channel % 4, channel, i))
+  return lines
+
+def lookaheads(patterns):
+  """ The lookahead combination, in chunks within the limit on groups
+  """
+  chunks = []
+  for start in range(0, len(patterns), 49):
+    chunk = patterns[start:start + 49]
+    regex = re.compile(''.join('(?:(?=[\\s\\S]*?(?P<p%d>%s))|)' % (i, getSource(p)) for (i, p) in enumerate(chunk)))
+    chunks.append((regex, [ (regex.groupindex['p%d' % i], p) for (i, p) in enumerate(chunk) ]))
+
+  def match(string):
+    found = set()
+    for (regex, slots) in chunks:
+      groups = regex.match(string).groups()
+      for (index, pattern) in slots:
+        if groups[index - 1] is not None:
+          found.add(pattern)
+    return found
+  return match
+
+def run(match, lines):
+  start = time.time()
+  found = 0
+  for line in lines:
+    found += len(match(line))
+  return (time.time() - start, found)
+
+if __name__ == "__main__":
+  sizes = [int(n) for n in sys.argv[1:]] or [5, 20, 100, 500]
+
+  print "%10s %14s %14s %14s" % ("patterns", "us/line", "lookahead", "matcher")
+  for n in sizes:
+    patterns = makePatterns(n)
+    lines = makeLines(n)
+
+    matcher = PatternMatcher()
+    for p in patterns:
+      matcher.add(p)
+
+    (separate, expected) = run(lambda s: set(p for p in patterns if p.search(s)), lines)
+    (combined, found) = run(lookaheads(patterns), lines)
+    assert found == expected
+    # Once to compile the alternations and then timed
+    run(matcher.match, lines)
+    (single, found) = run(matcher.match, lines)
+    assert found == expected
+
+    print "%10d %14.2f %14.2f %14.2f" % (n, separate * 1e6 / LINES,
+        combined * 1e6 / LINES, single * 1e6 / LINES)
@@ -0,0 +1,291 @@
+""" Benchmark of line throughput through the whole matching pipeline:
+  Process.errReceived -> Master -> expectation trees, without spawning any
+  real processes.
+
+  Each configuration floods the processes with single lines, mostly noise
+  with a proportion of the lines the expected is waiting for. Whenever the
+  expected completes, the history is cleared and a new expected is started,
+  as in a soak test. Starting an expected is timed separately from the
+  lines. The settings swept are:
+
+    processes: number of processes the lines are spread over
+    leaves:    number of Expected leaves in the tree
+    shape:     AllOf, OneOf or Sequence of the leaves, or NoneOf, where the
+               leaves never match and the tree is completed by one step
+    history:   lines in the history of each process when each expected is
+               started
+    consume:   proportion of the leaves which consume the line they match
+
+  By default each setting is swept in turn with the others left at their
+  default; --full runs every combination. Each configuration is run in a
+  separate interpreter so that its peak memory can be measured.
+
+  Results can be saved as a baseline and later runs compared against it:
+
+    python throughput.py --save before
+    ... change the code ...
+    python throughput.py --compare before
+
+  Usage: python throughput.py [--full] [--lines N] [--compile]
+                              [--save NAME] [--compare NAME] [--threshold PERCENT]
+"""
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+BASELINE_DIR = os.path.join(BENCHMARK_DIR, 'baselines')
+
+# Configure the path so that the test framework will be found
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+DEFAULTS = { 'processes' : 4, 'leaves' : 100, 'shape' : 'AllOf', 'history' : 100, 'consume' : 0.0 }
+
+SWEEPS = [
+  ('processes', [1, 4, 16]),
+  ('leaves',    [10, 100, 1000]),
+  ('shape',     ['AllOf', 'OneOf', 'Sequence', 'NoneOf']),
+  ('history',   [0, 100, 1000]),
+  ('consume',   [0.0, 0.5, 1.0]),
+]
+
+# Proportion of the lines which are the next line an expected is waiting for
+MATCH_RATIO = 0.1
+
+def configurations(full):
+  if full:
+    names = [ name for (name, values) in SWEEPS ]
+    for values in itertools.product(*[ values for (name, values) in SWEEPS ]):
+      yield dict(zip(names, values))
+    return
+
+  seen = set()
+  for (name, values) in SWEEPS:
+    for value in values:
+      config = dict(DEFAULTS)
+      config[name] = value
+      key = configKey(config)
+      if key not in seen:
+        seen.add(key)
+        yield config
+
+def configKey(config):
+  return " ".join("%s=%s" % (name, config[name]) for (name, values) in SWEEPS)
+
+def percentile(ordered, fraction):
+  return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Workload(object):
+  """ Builds the expected for one configuration and generates the lines sent
+  """
+  def __init__(self, config, lines, compile):
+    import xmos.test.master as master
+    import xmos.test.process as process
+
+    self.config = config
+    self.lines = lines
+    self.random = random.Random(1)
+    self.master = master.Master(compile=compile)
+    self.names = [ 'ep%d' % n for n in range(config['processes']) ]
+    self.processes = [ process.Process(name, self.master) for name in self.names ]
+    self.completed = 0
+    self.restart = False
+
+    # The lines the current expected is waiting for, in the order they are sent
+    self.steps = []
+
+  def build(self):
+    from xmos.test.base import AllOf, OneOf, NoneOf, Sequence, Expected
+
+    config = self.config
+    tree = self.completed
+    leaves = []
+    self.steps = []
+    for n in range(config['leaves']):
+      name = self.names[n % len(self.names)]
+      line = "tree %d step %d" % (tree, n)
+      consume = self.random.random() < config['consume']
+      if config['shape'] == 'NoneOf':
+        leaves.append(Expected(name, "^forbidden %d$" % n))
+      else:
+        leaves.append(Expected(name, "^%s$" % line, consumeOnMatch=consume))
+        self.steps.append((name, line))
+
+    shape = config['shape']
+    if shape == 'AllOf':
+      return AllOf(leaves)
+    if shape == 'OneOf':
+      return OneOf(leaves)
+    if shape == 'Sequence':
+      return Sequence(leaves)
+
+    line = "tree %d done" % tree
+    self.steps = [(self.names[0], line)]
+    return AllOf([NoneOf(leaves), Expected(self.names[0], "^%s$" % line)])
+
+  def expect(self):
+    """ Start a new expected with a fresh history. Returns the time taken by
+      the master to start it, which includes checking it against the history.
+    """
+    elapsed = 0
+    while True:
+      for p in self.processes:
+        p.clearExpectHistory()
+        for n in range(self.config['history']):
+          p.recordLine("history line %d\n" % n)
+
+      tree = self.build()
+      start = time.time()
+      d = self.master.expect(tree)
+      elapsed += time.time() - start
+      if not isinstance(d, list):
+        d.addCallback(self.done)
+        return elapsed
+      # Already seen in the history
+      self.completed += 1
+
+  def done(self, remaining):
+    self.completed += 1
+    self.restart = True
+
+  def run(self):
+    """ Returns the times taken to handle each line and to start each expected
+    """
+    processes = dict(zip(self.names, self.processes))
+    times = []
+    starts = [self.expect()]
+    step = 0
+    for n in xrange(self.lines):
+      if self.random.random() < MATCH_RATIO and step < len(self.steps):
+        (name, line) = self.steps[step]
+        step += 1
+      else:
+        name = self.names[n % len(self.names)]
+        line = "noise line %d" % n
+
+      start = time.time()
+      processes[name].errReceived(line + "\n")
+      times.append(time.time() - start)
+
+      if self.restart:
+        self.restart = False
+        starts.append(self.expect())
+        step = 0
+    return (times, starts)
+
+
+def runOne(config, lines, compile):
+  """ Run one configuration in this interpreter and return its results
+  """
+  logging.basicConfig(level=logging.WARNING)
+  workload = Workload(config, lines, compile)
+  (times, starts) = workload.run()
+  total = sum(times)
+  times.sort()
+
+  results = dict(config)
+  results.update({
+    'lines' : lines,
+    'seconds' : total,
+    'lines_per_sec' : lines / total if total else 0,
+    'p50_us' : percentile(times, 0.5) * 1e6,
+    'p90_us' : percentile(times, 0.9) * 1e6,
+    'p99_us' : percentile(times, 0.99) * 1e6,
+    'max_us' : times[-1] * 1e6,
+    'expected_completed' : workload.completed,
+    'expect_us' : sum(starts) / len(starts) * 1e6,
+    'peak_rss_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+  })
+  return results
+
+def runIsolated(config, lines, compile):
+  command = [sys.executable, os.path.realpath(__file__), '--run', json.dumps(config), '--lines', str(lines)]
+  if compile:
+    command.append('--compile')
+  output = subprocess.check_output(command)
+  return json.loads(output.splitlines()[-1])
+
+def getCommit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                   cwd=BENCHMARK_DIR, stderr=subprocess.STDOUT).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def baselinePath(name):
+  if os.sep in name or name.endswith('.json'):
+    return name
+  return os.path.join(BASELINE_DIR, name + '.json')
+
+def printResults(results, baseline, threshold):
+  previous = dict((configKey(r), r) for r in baseline['results']) if baseline else {}
+
+  print "%-64s %9s %7s %7s %8s %9s %7s" % ("configuration", "lines/s", "p50 us", "p99 us", "max us", "expect us", "peak MB")
+  regressions = 0
+  for r in results:
+    key = configKey(r)
+    peak = "%7.1f" % (r['peak_rss_kb'] / 1024.0) if r['peak_rss_kb'] else "%7s" % '-'
+    line = "%-64s %9.0f %7.1f %7.1f %8.1f %9.1f %s" % (key, r['lines_per_sec'], r['p50_us'],
+        r['p99_us'], r['max_us'], r['expect_us'], peak)
+
+    if key in previous:
+      old = previous[key]
+      change = (r['lines_per_sec'] / old['lines_per_sec'] - 1) * 100 if old['lines_per_sec'] else 0
+      line += " %+6.1f%%" % change
+      if change < -threshold:
+        line += " REGRESSION"
+        regressions += 1
+    print line
+
+  if baseline:
+    print
+    print "Compared against baseline from %s (commit %s): %d regression(s) over %.0f%%" % (
+        baseline['date'], baseline['commit'], regressions, threshold)
+  return regressions
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Line throughput benchmark")
+  parser.add_argument('--full', action='store_true', help="run every combination of the settings")
+  parser.add_argument('--lines', type=int, default=10000, help="lines sent for each configuration")
+  parser.add_argument('--compile', action='store_true', help="use the compiled form of the expected")
+  parser.add_argument('--save', metavar='NAME', help="save the results as a baseline")
+  parser.add_argument('--compare', metavar='NAME', help="compare the results against a baseline")
+  parser.add_argument('--threshold', type=float, default=10, help="percentage drop in lines/s reported as a regression")
+  parser.add_argument('--run', metavar='CONFIG', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.run:
+    print json.dumps(runOne(json.loads(args.run), args.lines, args.compile))
+    sys.exit(0)
+
+  baseline = None
+  if args.compare:
+    with open(baselinePath(args.compare)) as f:
+      baseline = json.load(f)
+
+  results = [ runIsolated(config, args.lines, args.compile) for config in configurations(args.full) ]
+  regressions = printResults(results, baseline, args.threshold)
+
+  if args.save:
+    path = baselinePath(args.save)
+    if not os.path.exists(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+      json.dump({ 'commit' : getCommit(), 'date' : datetime.datetime.now().isoformat(),
+                  'compile' : args.compile, 'lines' : args.lines, 'results' : results }, f, indent=2)
+    print "Saved baseline to %s" % path
+
+  sys.exit(1 if regressions else 0)
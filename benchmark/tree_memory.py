@@ -0,0 +1,120 @@
+""" Benchmark of the memory used by expectation trees and the results allocated
+  while checking lines against them.
+
+  Each tree shape is built with the given number of leaves, spread over 64
+  channels of one endpoint as for a per-channel test. The memory reported is
+  the size of the tree objects and the containers they own. Compiled
+  patterns, functions and strings shared between trees are not counted.
+
+  Lines that don't match are then checked against the tree, which is the
+  common case, and the number of ExpectedResult objects created per line is
+  counted.
+
+  Usage: python tree_memory.py [leaves ...]
+"""
+import collections
+import os
+import sys
+import time
+import logging
+
+# Configure the path so that the test framework will be found
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import xmos.test.base as base
+import xmos.test.master as master
+import xmos.test.process as process
+from xmos.test.base import AllOf, OneOf, Expected, ExpectedResult, Sequence
+
+CHANNELS = 64
+LINES = 50
+
+def leaves(count):
+  return [Expected('ep0', "channel %d: sample %d ok" % (n % CHANNELS, n), 10) for n in range(count)]
+
+SHAPES = {
+  'AllOf'          : lambda count: AllOf(leaves(count)),
+  'OneOf'          : lambda count: OneOf(leaves(count)),
+  'AllOf/Sequence' : lambda count: AllOf([Sequence(list(l)) for l in
+                         zip(*[iter(leaves(count))] * (count / CHANNELS))]),
+}
+
+_containers = (list, set, frozenset, dict, collections.deque)
+
+def treeSize(tree):
+  """ Size of the nodes of the tree and the containers they own
+  """
+  seen = set()
+  size = 0
+  stack = [tree]
+  while stack:
+    obj = stack.pop()
+    if id(obj) in seen:
+      continue
+    seen.add(id(obj))
+    size += sys.getsizeof(obj)
+
+    if isinstance(obj, _containers):
+      stack.extend(obj.values() if isinstance(obj, dict) else obj)
+      continue
+    if isinstance(obj, base.OrderedSet):
+      stack.extend([obj.items, obj.index])
+      continue
+    if not isinstance(obj, (base.Waitable, Sequence)):
+      continue
+
+    if hasattr(obj, '__dict__'):
+      size += sys.getsizeof(obj.__dict__)
+      attrs = obj.__dict__.values()
+    else:
+      attrs = [ value for (name, value) in base._slotItems(obj) ]
+    stack.extend(a for a in attrs if isinstance(a, _containers + (base.OrderedSet, base.Waitable, Sequence)))
+  return size
+
+class AllocationCounter(object):
+  """ Counts the ExpectedResult objects created
+  """
+  def __init__(self):
+    self.count = 0
+    self.init = ExpectedResult.__init__
+
+  def __enter__(self):
+    counter = self
+    def init(self, *args, **kwargs):
+      counter.count += 1
+      counter.init(self, *args, **kwargs)
+    ExpectedResult.__init__ = init
+    return self
+
+  def __exit__(self, *args):
+    ExpectedResult.__init__ = self.init
+
+def run(shape, count):
+  base.activeProcesses.clear()
+  m = master.Master()
+  ep0 = process.Process('ep0', m)
+
+  tree = SHAPES[shape](count)
+  size = treeSize(tree)
+  m.expect(tree)
+
+  with AllocationCounter() as counter:
+    start = time.time()
+    for n in range(LINES):
+      ep0.errReceived("channel %d: sample %d dropped\n" % (n % CHANNELS, n))
+    elapsed = time.time() - start
+
+  for e in m.expected:
+    e.cancelTimeouts()
+  return (size, counter.count, elapsed)
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.WARNING)
+  sizes = [int(n) for n in sys.argv[1:]] or [1000, 10000]
+
+  print "%16s %8s %12s %10s %14s %10s" % ("shape", "leaves", "tree bytes", "bytes/leaf", "results/line", "ms/line")
+  for shape in sorted(SHAPES):
+    for count in sizes:
+      (size, results, elapsed) = run(shape, count)
+      print "%16s %8d %12d %10.1f %14.1f %10.2f" % (shape, count, size, float(size) / count,
+          float(results) / LINES, elapsed * 1000 / LINES)
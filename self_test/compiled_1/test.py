@@ -0,0 +1,167 @@
+import sys
+import os
+import random
+import logging
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import xmos.test.process as process
+import xmos.test.master as master
+import xmos.test.base as base
+import xmos.test.xmos_logging as xmos_logging
+from xmos.test.base import AllOf, OneOf, NoneOf, Sequence, Expected
+from xmos.test.session import Session
+
+endpoints = ['ep0', 'ep1']
+
+def seen(message, critical):
+  xmos_logging.log_info(message.splitlines()[0])
+
+# Each scenario is a name, a function to build the tree, the lines received
+# before the expect and those received after it. A line of None moves the
+# clock on past the timeouts.
+scenarios = [
+  ("startup",
+   lambda: AllOf([Expected(e, "Started", 10) for e in endpoints]),
+   [],
+   [('ep1', "Started"), ('ep0', "noise"), ('ep0', "Started")]),
+  ("next steps",
+   lambda: AllOf([AllOf([Expected('ep0', "Next", 10)]), AllOf([Expected('ep1', "Next", 10)])]),
+   [('ep1', "Next")],
+   [('ep0', "Next")]),
+  ("sequences",
+   lambda: AllOf([Sequence([Expected(e, "Count0", 10), Expected(e, "Count1", 10)]) for e in endpoints]),
+   [('ep0', "Count1")],
+   [('ep0', "Count0"), ('ep1', "Count0"), ('ep0', "Count1"), ('ep1', "Count1")]),
+  ("one of",
+   lambda: OneOf([Sequence([Expected('ep0', "link up", 10), Expected('ep0', "stream started", 10)]),
+                  Sequence([Expected('ep1', "link down", 10), Expected('ep1', "retry", 10)])]),
+   [],
+   [('ep1', "link down"), ('ep0', "link up"), ('ep1', "retry")]),
+  ("none of",
+   lambda: AllOf([Expected('ep0', "done", 10), NoneOf([Expected('ep1', "failed", 10)], errorFn=seen)]),
+   [],
+   [('ep1', "failed"), ('ep0', "done")]),
+  ("consumed history",
+   lambda: Sequence([Expected('ep0', r"value \d", 10, consumeOnMatch=True), Expected('ep0', r"value \d", 10)]),
+   [('ep0', "value 1"), ('ep0', "value 2")],
+   []),
+  ("timeout",
+   lambda: AllOf([Expected('ep0', "ready", 10), Expected('ep1', "ready", 2, errorFn=seen)]),
+   [],
+   [('ep0', "ready"), None]),
+]
+
+class Run(object):
+  """ Feeds lines to a tree with a master of its own and records when the
+    expect completes
+  """
+  def __init__(self, compile):
+    self.clock = base.VirtualClock()
+    self.master = master.Master(clock=self.clock, compile=compile, session=Session())
+    self.processes = dict((e, process.Process(e, self.master)) for e in endpoints)
+    self.lines = 0
+    self.completed = None
+
+  def receive(self, lines):
+    for line in lines:
+      if line is None:
+        self.clock.runUntilIdle()
+        continue
+      (name, string) = line
+      self.lines += 1
+      self.processes[name].errReceived(string + "\n")
+
+  def expect(self, tree, before, after):
+    self.receive(before)
+    d = self.master.expect(tree)
+    if isinstance(d, list):
+      self.completed = self.lines
+    else:
+      d.addCallback(self.expectCompleted)
+    self.receive(after)
+    history = [ len(self.processes[e].output_history) for e in endpoints ]
+    return (self.completed, history)
+
+  def expectCompleted(self, result):
+    self.completed = self.lines
+
+def randomTree(r, depth=0):
+  """ A random tree in the style of the scenarios above
+  """
+  kind = r.randint(0, 4) if depth < 2 else 0
+  if kind == 0:
+    return randomLeaf(r)
+  if kind == 3:
+    # NoneOf only takes leaves
+    return NoneOf([ randomLeaf(r) for n in range(r.randint(1, 2)) ],
+                  errorFn=lambda message, critical: None)
+  members = [ randomTree(r, depth + 1) for n in range(r.randint(1, 3)) ]
+  if kind == 1:
+    return AllOf(members)
+  if kind == 2:
+    return OneOf(members)
+  return Sequence(members)
+
+def randomLeaf(r):
+  return Expected(r.choice(endpoints), "step %d" % r.randint(0, 3), 10,
+                  consumeOnMatch=r.random() < 0.3)
+
+def randomLines(r, count):
+  return [ (r.choice(endpoints), "step %d" % r.randint(0, 3)) for n in range(count) ]
+
+def runRandom(compile, seed, trees):
+  """ Runs random trees one after the other on one master, returning the
+    line each completed on
+  """
+  r = random.Random(seed)
+  run = Run(compile)
+  results = []
+  for n in range(trees):
+    tree = randomTree(r)
+    results.append(run.expect(tree, randomLines(r, r.randint(0, 4)), randomLines(r, r.randint(0, 12))))
+    if run.master.deferred:
+      # Left waiting on lines which never came
+      for e in run.master.expected:
+        e.cancelTimeouts()
+      run.master.callDeferred()
+  return results
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  args = parser.parse_args()
+
+  xmos_logging.configure_logging(level_file='DEBUG', filename=args.logfile)
+
+  # Each scenario is run on the interpreted tree and then on the compiled one,
+  # which must complete on the same line and leave the same history
+  for (name, makeTree, before, after) in scenarios:
+    results = []
+    for compile in (False, True):
+      xmos_logging.log_info("%s, %s:" % (name, "compiled" if compile else "interpreted"))
+      results.append(Run(compile).expect(makeTree(), before, after))
+    (completed, history) = results[0]
+    if results[0] != results[1]:
+      xmos_logging.log_error("%s: interpreted %s, compiled %s" % (name, results[0], results[1]))
+    else:
+      xmos_logging.log_info("%s: completed on line %s in both, history %s" % (name, completed, history))
+
+  # Random trees, each run on a master which keeps the history of those before.
+  # Only the differences are logged.
+  level = logging.getLogger().level
+  for seed in range(5):
+    logging.getLogger().setLevel(logging.WARNING)
+    results = [ runRandom(compile, seed, 40) for compile in (False, True) ]
+    logging.getLogger().setLevel(level)
+    differ = [ n for n in range(len(results[0])) if results[0][n] != results[1][n] ]
+    if differ:
+      xmos_logging.log_error("random %d: trees %s differ" % (seed, differ))
+    else:
+      completed = len([ r for r in results[0] if r[0] is not None ])
+      xmos_logging.log_info("random %d: %d of %d trees completed the same in both" % (seed, completed, len(results[0])))
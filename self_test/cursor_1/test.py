@@ -0,0 +1,54 @@
+import sys
+import os
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import xmos.test.process as process
+import xmos.test.master as master
+import xmos.test.base as base
+import xmos.test.xmos_logging as xmos_logging
+from xmos.test.base import AllOf, NoneOf, Sequence, Expected
+
+def seenBad(message, critical):
+  xmos_logging.log_info(message.splitlines()[0])
+
+@inlineCallbacks
+def runTest(args):
+  """ The Sequence moves on to a line already in the history when the NoneOf
+    before it is seen, which neither starts nor completes the Sequence. The
+    history has to be checked again for it once the AllOf starts.
+  """
+  ep1.errReceived("target\n")
+
+  master.addExpected(AllOf([Expected('ep0', "go", 2), Expected('ep0', "done", 2)]))
+  master.addExpected(Sequence([NoneOf([Expected('ep1', "bad", 2)], errorFn=seenBad),
+                               Expected('ep1', "target", 2)]))
+  master.startNext()
+
+  reactor.callLater(0.1, ep1.errReceived, "bad\n")
+  reactor.callLater(0.2, ep0.errReceived, "go\n")
+  reactor.callLater(0.3, ep0.errReceived, "done\n")
+  yield master.expect()
+
+  base.testComplete(reactor)
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  args = parser.parse_args()
+
+  xmos_logging.configure_logging(level_file='DEBUG', filename=args.logfile)
+
+  master = master.Master()
+  ep0 = process.Process('ep0', master)
+  ep1 = process.Process('ep1', master)
+
+  base.testStart(runTest, args)
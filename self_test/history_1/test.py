@@ -0,0 +1,63 @@
+import sys
+import os
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import xmos.test.process as process
+import xmos.test.master as master
+import xmos.test.base as base
+import xmos.test.xmos_logging as xmos_logging
+
+def readHistory(p, consume=None, more=None):
+  """ Read the history of a process through a view, receiving more lines
+    and consuming a line once the first line has been read
+  """
+  lines = []
+  for (position, line) in p.iterExpectHistory(0):
+    lines.append(line.strip())
+    if position == 0:
+      if more:
+        p.errReceived(more)
+      if consume:
+        p.consume(consume)
+  return ", ".join(lines)
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  args = parser.parse_args()
+
+  xmos_logging.configure_logging(level_file='DEBUG', filename=args.logfile)
+
+  master = master.Master()
+
+  # A line consumed while the view is open is skipped
+  ep0 = process.Process('ep0', master)
+  ep0.errReceived("one\ntwo\nthree\nfour\n")
+  xmos_logging.log_info("ep0 consumed three: %s" % readHistory(ep0, consume="three\n"))
+  xmos_logging.log_info("ep0 after: %s" % readHistory(ep0))
+
+  # Lines received while the view is open are not read
+  xmos_logging.log_info("ep0 received five: %s" % readHistory(ep0, more="five\n"))
+  xmos_logging.log_info("ep0 after: %s" % readHistory(ep0))
+
+  # Once lines have been evicted the view keeps reading the lines from before
+  # the eviction, so a line consumed afterwards is still read
+  ep1 = process.Process('ep1', master, history_window=250, history_spill=True)
+  ep1.errReceived("one\ntwo\nthree\nfour\n")
+  xmos_logging.log_info("ep1 consumed three after eviction: %s" % readHistory(ep1,
+      consume="three\n", more="".join("line %d\n" % n for n in range(4))))
+  xmos_logging.log_info("ep1 after: %s" % readHistory(ep1))
+  xmos_logging.log_info("ep1 spilled %(spilled)d lines" % ep1.getHistoryMemory())
+  ep1.output_history.close()
+
+  # Without a spill file no lines can be dropped while no expected is live,
+  # so the lines received over the window are counted
+  ep2 = process.Process('ep2', master, history_window=20)
+  ep2.errReceived("".join("line %d\n" % n for n in range(8)))
+  xmos_logging.log_info("ep2 held %(lines)d lines, %(over_window)d over the window" % ep2.getHistoryMemory())
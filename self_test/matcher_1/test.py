@@ -0,0 +1,43 @@
+import sys
+import os
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import xmos.test.process as process
+import xmos.test.master as master
+import xmos.test.base as base
+import xmos.test.xmos_logging as xmos_logging
+from xmos.test.base import AllOf, Expected
+
+@inlineCallbacks
+def runTest(args):
+  """ Waits on patterns which can't all be combined into one expression,
+    as two of them name the same group
+  """
+  yield master.expect(AllOf([Expected('ep0', r"(?P<state>link) up", 5),
+                             Expected('ep0', r"(?P<state>stream) started", 5),
+                             Expected('ep0', r"sample \d+ ok", 5),
+                             Expected('ep0', r"channel [0-3] locked", 5)]))
+  base.testComplete(reactor)
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  args = parser.parse_args()
+
+  xmos_logging.configure_logging(level_file='DEBUG', filename=args.logfile)
+
+  master = master.Master()
+  ep0 = process.Process('ep0', master)
+  for (when, line) in [(0.1, "link up"), (0.2, "channel 2 locked"), (0.3, "stream started"), (0.4, "sample 7 ok")]:
+    reactor.callLater(when, ep0.errReceived, line + "\n")
+
+  base.testStart(runTest, args)
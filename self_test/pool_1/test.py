@@ -0,0 +1,86 @@
+import sys
+import os
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import xmos.test.process as process
+import xmos.test.master as master
+import xmos.test.base as base
+import xmos.test.pool as pool
+import xmos.test.xmos_logging as xmos_logging
+from xmos.test.base import Expected
+
+class FakeEndpoint(process.Process):
+  """ An endpoint which acknowledges resets until it is wedged, rather than
+    running a real program
+  """
+  def __init__(self, name, master, **kwargs):
+    process.Process.__init__(self, name, master, **kwargs)
+    self.registerErrorPattern("link error")
+    self.wedged = False
+
+  def sendLine(self, command):
+    if not self.wedged:
+      reactor.callLater(0.05, self.errReceived, "ack %s\n" % command)
+
+  def output(self, line):
+    reactor.callLater(0.05, self.errReceived, line + "\n")
+
+  def kill(self):
+    xmos_logging.log_info("%s: killed" % self.name)
+    self.ended = True
+
+def spawn(process, command):
+  process.output("booted %s" % " ".join(command))
+
+endpoints = pool.EndpointPool(reset=pool.Reset("reset", "ack reset", 0.5), ready="booted",
+                              processClass=FakeEndpoint, spawn=spawn)
+
+@inlineCallbacks
+def runTest(args):
+  app = ['xrun', 'app.xe']
+
+  # A new endpoint is started and then reused
+  ep0 = yield endpoints.lease('ep0', app, master)
+  endpoints.release(ep0)
+  again = yield endpoints.lease('ep0', app, master)
+  xmos_logging.log_info("reused same process: %s" % (again is ep0))
+
+  # An error pattern matching makes the endpoint unhealthy
+  ep0.output("link error")
+  yield master.expect(Expected('ep0', "link error", 5))
+  endpoints.release(ep0)
+  ep0 = yield endpoints.lease('ep0', app, master)
+
+  # An endpoint which doesn't acknowledge the reset is replaced
+  ep0.wedged = True
+  endpoints.release(ep0)
+  ep0 = yield endpoints.lease('ep0', app, master)
+
+  # As is one running a different command line
+  endpoints.release(ep0)
+  ep0 = yield endpoints.lease('ep0', ['xrun', 'other.xe'], master)
+  endpoints.release(ep0)
+
+  xmos_logging.log_info(", ".join("%s %d" % item for item in sorted(endpoints.getCounts().items())))
+  base.testComplete(reactor)
+
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  args = parser.parse_args()
+
+  xmos_logging.configure_logging(level_file='DEBUG', filename=args.logfile)
+
+  master = master.Master()
+
+  base.testStart(runTest, args)
@@ -0,0 +1,78 @@
+import sys
+import os
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import xmos.test.process as process
+import xmos.test.master as master
+import xmos.test.base as base
+import xmos.test.replay as replay
+import xmos.test.xmos_logging as xmos_logging
+from xmos.test.base import AllOf, OneOf, NoneOf, Sequence, Expected
+
+endpoints = []
+
+@inlineCallbacks
+def runTest(args):
+  """ The same test as processes_1, checked against the console logs
+    recorded from a run of it. The ep0 log also has a line from the endpoint
+    which looks like one of the framework's own entries.
+  """
+
+  yield master.expect(Expected('ep0', "^connection made$", 30))
+
+  startup = AllOf([Expected(e, "PTP Role: Master", 30) for e in endpoints])
+
+  ptpslave = OneOf([
+      Sequence([Expected(e, "PTP Role: Slave", 5),
+            Expected(e, "PTP sync locked", 1)])
+      for e in endpoints
+    ])
+
+  talker_connections = [
+      Sequence([Expected(e, "MAAP reserved Talker stream #0 address: 91:E0:F0:0", 30),
+            Expected(e, "CONNECTING Talker stream #0", 10),
+            Expected(e, "Talker stream #0 ready", 10),
+            Expected(e, "Talker stream #0 on", 10)])
+      for e in endpoints
+    ]
+
+  listener_connections = [
+      Sequence([Expected(e, "CONNECTING Listener sink #0", 30),
+            AllOf([Expected(e, "%d -> %d" % (n, n), 10) for n in range(4)]),
+            AllOf([Expected(e, "Media output %d locked" % n, 10) for n in range(4)]),
+            NoneOf([Expected(e, "lost lock", 10)])])
+      for e in endpoints
+    ]
+
+  yield master.expect(startup)
+  for name,process in base.getActiveProcesses().iteritems():
+    process.registerErrorPattern("PTP Role: Master")
+  yield master.expect(AllOf([ptpslave] + talker_connections + listener_connections))
+
+  base.testComplete(reactor)
+
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  parser.add_argument("--realtime", action="store_true", help="replay with the original timing")
+  args = parser.parse_args()
+
+  xmos_logging.configure_logging(level_file='DEBUG', filename=args.logfile)
+
+  master = master.Master()
+
+  endpoints.extend(['ep0', 'ep1'])
+  logs = dict((e, "%s_console.log" % e) for e in endpoints)
+  replay.Replay(master, logs, realtime=args.realtime,
+                processClass=process.XrunProcess).start(runTest, args)
+  xmos_logging.log_info("clock restored: %s" % (base.getClock() is reactor))
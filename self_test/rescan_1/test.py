@@ -0,0 +1,121 @@
+import sys
+import os
+import random
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import logging
+import xmos.test.process as process
+import xmos.test.master as master
+import xmos.test.base as base
+import xmos.test.xmos_logging as xmos_logging
+from xmos.test.base import AllOf, OneOf, NoneOf, Sequence, Expected
+from xmos.test.session import Session
+
+endpoints = ['ep0', 'ep1', 'ep2']
+
+class RescanProcess(process.Process):
+  """ A process which never has a history cursor, so that the master checks
+    all of the history of each expected every time
+  """
+  def getHistoryCursor(self, expect_index):
+    return None
+
+def ignore(message, critical):
+  pass
+
+def randomLeaf(r):
+  return Expected(r.choice(endpoints), "tok[%d%d]" % (r.randint(0, 9), r.randint(0, 9)),
+                  r.randint(1, 6), errorFn=ignore)
+
+def randomTree(r, depth=0):
+  kind = r.randint(0, 4) if depth < 3 else 0
+  if kind == 0:
+    return randomLeaf(r)
+  if kind == 3:
+    # NoneOf only takes leaves
+    return NoneOf([ randomLeaf(r) for n in range(r.randint(1, 2)) ],
+                  errorFn=ignore)
+  members = [ randomTree(r, depth + 1) for n in range(r.randint(1, 3)) ]
+  if kind == 1:
+    return AllOf(members)
+  if kind == 2:
+    return OneOf(members)
+  return Sequence(members)
+
+def run(seed, processClass):
+  """ Expects random trees in turn, several at a time, with random lines
+    before and after each expect. Returns what happened to each expect and
+    the history indexes after it.
+  """
+  r = random.Random(seed)
+  clock = base.VirtualClock()
+  m = master.Master(clock=clock, session=Session())
+  processes = dict((e, processClass(e, m)) for e in endpoints)
+  lines = [0]
+  results = []
+
+  def receive(count):
+    for n in range(count):
+      lines[0] += 1
+      clock.advanceTo(clock.seconds() + r.random() * 0.6)
+      processes[r.choice(endpoints)].errReceived("tok%d\n" % r.randint(0, 9))
+
+  def expectCompleted(remaining):
+    results.append(("completed after a line", lines[0]))
+
+  for step in range(20):
+    receive(r.randint(0, 10))
+    for n in range(r.randint(1, 3)):
+      m.addExpected(randomTree(r))
+    m.startNext()
+    d = m.expect()
+    if isinstance(d, list):
+      results.append(("completed from history",))
+    else:
+      d.addCallback(expectCompleted)
+    receive(r.randint(0, 15))
+    if m.deferred:
+      results.append(("left waiting", len(m.active)))
+      for e in m.expected:
+        e.cancelTimeouts()
+      m.callDeferred()
+    results.append([ sorted(processes[e].history_indexes.items()) for e in endpoints ])
+    if r.random() < 0.1:
+      for p in processes.values():
+        p.clearExpectHistory()
+  return results
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  args = parser.parse_args()
+
+  xmos_logging.configure_logging(level_file='DEBUG', filename=args.logfile)
+
+  # The same trees and lines are run with the history cursors and with a full
+  # check of the history, which must give the same results. Only the
+  # differences are logged.
+  level = logging.getLogger().level
+  outcomes = {}
+  for seed in range(40):
+    logging.getLogger().setLevel(logging.WARNING)
+    (rescan, cursor) = [ run(seed, processClass) for processClass in (RescanProcess, process.Process) ]
+    logging.getLogger().setLevel(level)
+
+    differ = [ n for n in range(len(rescan)) if rescan[n] != cursor[n] ]
+    if differ:
+      xmos_logging.log_error("seed %d: differs from a full check of the history at %s: %s / %s" % (
+          seed, differ[0], rescan[differ[0]], cursor[differ[0]]))
+
+    for result in cursor:
+      if isinstance(result, tuple):
+        outcomes[result[0]] = outcomes.get(result[0], 0) + 1
+
+  for (outcome, count) in sorted(outcomes.items()):
+    xmos_logging.log_info("%s: %d" % (outcome, count))
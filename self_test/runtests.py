@@ -1,26 +1,225 @@
 #!/usr/bin/python
+""" Runs the self tests and compares their output against expected.output.
 
+  Tests are run concurrently, each by a worker which starts the test in its
+  own interpreter and waits on it. Every test runs from a fresh copy of its
+  directory so that the files tests write can't interfere, with the
+  framework put on its path.
+
+  The output of each test is compared line by line as it is produced and
+  is written to test.output in the copy of the test directory, which is
+  kept when --workdir is given. A test which runs for longer than the
+  timeout is killed along with every process it started.
+
+  Usage: python runtests.py [-j JOBS] [--timeout SECONDS] [--shard K/N]
+                            [--junit FILE] [--json FILE] [--workdir DIR] [test ...]
+"""
+import argparse
+import difflib
+import json
+import multiprocessing
+import multiprocessing.pool
 import os
+import shutil
+import signal
 import subprocess
-import re
+import sys
+import tempfile
+import threading
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+top_dir = os.path.dirname(os.path.realpath(__file__))
+
+# The directory holding the framework package
+framework_dir = os.path.dirname(top_dir)
+
+def findTests(names=None):
+  tests = sorted(d for d in os.listdir(top_dir) if os.path.isdir(os.path.join(top_dir, d)))
+  if names:
+    unknown = set(names) - set(tests)
+    if unknown:
+      sys.exit("Unknown tests: %s" % ", ".join(sorted(unknown)))
+    tests = [ t for t in tests if t in names ]
+  return tests
+
+def shard(tests, spec):
+  """ Returns the tests in shard K of N, given as 'K/N' with K counting from 1
+  """
+  (k, n) = [ int(x) for x in spec.split('/') ]
+  if not 1 <= k <= n:
+    sys.exit("Invalid shard %s" % spec)
+  return tests[k - 1::n]
+
+
+class OutputChecker(object):
+  """ Compares the lines of output against the expected output as they
+    arrive, remembering the first line which differs.
+  """
+  def __init__(self, expected):
+    self.expected = expected
+    self.count = 0
+    self.mismatch = None
+
+  def add(self, line):
+    if self.mismatch is None and self.expected is not None:
+      if self.count >= len(self.expected) or self.expected[self.count] != line:
+        self.mismatch = self.count + 1
+    self.count += 1
+
+  def finish(self):
+    if self.expected is None:
+      return False
+    if self.mismatch is None and self.count != len(self.expected):
+      self.mismatch = self.count + 1
+    return self.mismatch is None
+
+
+def killGroup(proc):
+  try:
+    if hasattr(os, 'killpg'):
+      os.killpg(proc.pid, signal.SIGKILL)
+    else:
+      proc.kill()
+  except OSError:
+    pass
+
+def runTest(name, work_root, timeout):
+  """ Run one test and return its result
+  """
+  test_dir = os.path.join(top_dir, name)
+  work_dir = os.path.join(work_root, name)
+  shutil.copytree(test_dir, work_dir, ignore=shutil.ignore_patterns('*.pyc', 'test.output'))
+
+  expected = None
+  expected_file = os.path.join(test_dir, 'expected.output')
+  if os.path.exists(expected_file):
+    with open(expected_file) as f:
+      expected = f.readlines()
+  checker = OutputChecker(expected)
 
-test_dirs = [d for d in os.listdir('.') if os.path.isdir(d)]
-test_dirs.sort()
+  start = time.time()
+  kwargs = {}
+  if hasattr(os, 'setsid'):
+    # Start a process group so that everything the test starts can be killed
+    kwargs['preexec_fn'] = os.setsid
 
-top_dir = os.getcwd()
+  # The copy can't find the framework from where it is
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join([framework_dir] + [ p for p in [env.get('PYTHONPATH')] if p ])
 
-for d in test_dirs:
-  print "---- Running {test_dir} ----".format(test_dir=d)
+  proc = subprocess.Popen([sys.executable, '-u', os.path.join(work_dir, 'test.py')],
+                          cwd=work_dir, env=env, stdin=open(os.devnull), stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, **kwargs)
 
-  # This was done using subprocess.call, but that fails to work with the
-  # tests using the Twisted framework
-  os.chdir(os.path.join(top_dir, d))
-  os.system("python test.py > test.output 2>&1")
+  timed_out = threading.Event()
+  def expire():
+    timed_out.set()
+    killGroup(proc)
+  timer = threading.Timer(timeout, expire)
+  timer.start()
 
-  err = subprocess.call(["diff","test.output","expected.output"])
+  output = []
+  try:
+    for line in iter(proc.stdout.readline, ''):
+      output.append(line)
+      checker.add(line)
+    proc.wait()
+  finally:
+    timer.cancel()
+    timer.join()
 
-  if err == 0:
-      print "PASSED"
+  # Stop anything the test left running
+  killGroup(proc)
+  elapsed = time.time() - start
+
+  with open(os.path.join(work_dir, 'test.output'), 'w') as f:
+    f.writelines(output)
+
+  passed = checker.finish() and not timed_out.is_set()
+  if timed_out.is_set():
+    message = "Timed out after %d seconds" % timeout
+  elif expected is None:
+    message = "No expected.output"
+  elif not passed:
+    message = "Mismatch between actual and expected outputs at line %d" % checker.mismatch
   else:
-      print "ERROR: Mismatch between actual and expected outputs"
+    message = None
+
+  diff = ''
+  if expected is not None and not passed:
+    diff = ''.join(difflib.unified_diff(expected, output, 'expected.output', 'test.output'))
+
+  return { 'name' : name, 'passed' : passed, 'message' : message, 'seconds' : elapsed,
+           'returncode' : proc.returncode, 'diff' : diff }
+
+def report(result):
+  print "---- Running {test_dir} ----".format(test_dir=result['name'])
+  if result['passed']:
+    print "PASSED"
+  else:
+    print "ERROR: %s" % result['message']
+    sys.stdout.write(result['diff'])
+  sys.stdout.flush()
+
+def writeJUnit(filename, results, elapsed):
+  failures = len([ r for r in results if not r['passed'] ])
+  with open(filename, 'w') as f:
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write('<testsuite name="self_test" tests="%d" failures="%d" time="%.3f">\n' % (
+        len(results), failures, elapsed))
+    for r in results:
+      f.write('  <testcase classname="self_test" name=%s time="%.3f">' % (quoteattr(r['name']), r['seconds']))
+      if not r['passed']:
+        f.write('\n    <failure message=%s>%s</failure>\n  ' % (quoteattr(r['message']), escape(r['diff'])))
+      f.write('</testcase>\n')
+    f.write('</testsuite>\n')
+
+def writeJson(filename, results, elapsed):
+  with open(filename, 'w') as f:
+    json.dump({ 'tests' : len(results), 'failures' : len([ r for r in results if not r['passed'] ]),
+                'seconds' : elapsed, 'results' : results }, f, indent=2)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Run the self tests')
+  parser.add_argument('tests', nargs='*', help='tests to run, all by default')
+  parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+      help='number of tests to run at once')
+  parser.add_argument('--timeout', type=float, default=600, help='seconds allowed for each test')
+  parser.add_argument('--shard', metavar='K/N', help='only run shard K of N')
+  parser.add_argument('--junit', metavar='FILE', help='write JUnit XML results to FILE')
+  parser.add_argument('--json', metavar='FILE', help='write JSON results to FILE')
+  parser.add_argument('--workdir', metavar='DIR', help='run the tests in DIR and keep it')
+  args = parser.parse_args()
+
+  tests = findTests(args.tests)
+  if args.shard:
+    tests = shard(tests, args.shard)
+
+  work_root = args.workdir or tempfile.mkdtemp(prefix='self_test.')
+  if not os.path.exists(work_root):
+    os.makedirs(work_root)
+
+  start = time.time()
+  pool = multiprocessing.pool.ThreadPool(max(1, args.jobs))
+  try:
+    results = []
+    for result in pool.imap_unordered(lambda name: runTest(name, work_root, args.timeout), tests):
+      report(result)
+      results.append(result)
+  finally:
+    pool.close()
+    pool.join()
+    if not args.workdir:
+      shutil.rmtree(work_root, ignore_errors=True)
+  elapsed = time.time() - start
+
+  results.sort(key=lambda r: r['name'])
+  if args.junit:
+    writeJUnit(args.junit, results, elapsed)
+  if args.json:
+    writeJson(args.json, results, elapsed)
 
+  failures = len([ r for r in results if not r['passed'] ])
+  print "%d tests, %d failed in %.1f seconds" % (len(results), failures, elapsed)
+  sys.exit(1 if failures else 0)
@@ -0,0 +1,84 @@
+import sys
+import os
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import xmos.test.base as base
+import xmos.test.scheduler as scheduler
+import xmos.test.xmos_logging as xmos_logging
+from xmos.test.base import AllOf, Expected
+
+# Fake adapters, run using the stub xrun script
+inventory = scheduler.Inventory(xrun=[sys.executable, '-u', 'xrun'])
+inventory.addDevice('ep0', 'A1', tags=['avb'])
+inventory.addDevice('ep1', 'A2', tags=['avb'])
+inventory.addDevice('ep2', 'A3', tags=['spare'])
+inventory.addDevice('ep3', 'A4', tags=['kill'])
+
+tests = scheduler.Scheduler(inventory, timeout=30)
+
+allocated = {}
+
+@inlineCallbacks
+def runApp(args, devices):
+  """ Runs the application on each device until it is done
+  """
+  allocated[base.getSession().name] = [ d.name for d in devices ]
+  for device in devices:
+    tests.startXrun(device, ['app.xe'])
+  master = base.getSession().getMaster()
+  yield master.expect(AllOf([Expected(d.name, "app.xe done", 10) for d in devices]))
+  base.testComplete(reactor)
+
+# The xrun killed when the test using it completed
+killed = []
+
+@inlineCallbacks
+def runKilled(args, devices):
+  """ Completes while the application is still running, so xrun is killed
+  """
+  allocated[base.getSession().name] = [ d.name for d in devices ]
+  killed.append(tests.startXrun(devices[0], ['--seconds', '10', 'app.xe']))
+  master = base.getSession().getMaster()
+  yield master.expect(Expected(devices[0].name, "app.xe running", 10))
+  base.testComplete(reactor)
+
+def runAfterKilled(args, devices):
+  """ The device is only free once the killed xrun has ended
+  """
+  if not killed or not killed[0].ended:
+    base.testError("started before the killed xrun ended")
+  return runApp(args, devices)
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  args = parser.parse_args()
+
+  # The order in which the tests run depends on timing, so only the results
+  # are checked
+  xmos_logging.configure_logging(level_console='WARNING', level_file='DEBUG', filename=args.logfile)
+
+  tests.addTest('single_a', runApp, requires=['avb'])
+  tests.addTest('single_b', runApp, requires=['avb'])
+  tests.addTest('pair', runApp, requires=['avb', 'avb'])
+  tests.addTest('spare', runApp, requires=['spare'])
+  tests.addTest('named', runApp, requires=['ep1'])
+  tests.addTest('too_many', runApp, requires=['avb', 'avb', 'avb'])
+  tests.addTest('killed', runKilled, requires=['kill'])
+  tests.addTest('after_killed', runAfterKilled, requires=['kill'])
+
+  sessions = tests.run(args)
+
+  for session in sessions:
+    print "%s %s on %s" % (session.name, 'PASSED' if session.passed() else 'FAILED',
+        ", ".join(allocated.get(session.name, ['nothing'])))
+  print "At most %d tests ran at once" % tests.getUtilisation()['peak_running']
@@ -0,0 +1,77 @@
+import sys
+import os
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import xmos.test.process as process
+import xmos.test.base as base
+import xmos.test.xmos_logging as xmos_logging
+from xmos.test.base import AllOf, Expected
+
+def startEndpoint(lines):
+  """ Create an endpoint in the current session which outputs each line at
+    the given time rather than running a real program.
+  """
+  ep0 = process.Process('ep0', base.getSession().getMaster())
+  for (when, line) in lines:
+    reactor.callLater(when, ep0.errReceived, line + "\n")
+  return ep0
+
+@inlineCallbacks
+def passes(args):
+  """ Sees all of its lines, with a sleep in between
+  """
+  master = base.getSession().getMaster()
+  startEndpoint([(0.2, "link up"), (1.0, "stream started")])
+
+  yield master.expect(Expected('ep0', "link up", 5))
+  yield base.sleep(0.2)
+  yield master.expect(Expected('ep0', "stream started", 5))
+  base.testComplete(reactor)
+
+@inlineCallbacks
+def timesOut(args):
+  """ Never sees its second line, which times out while the others run
+  """
+  master = base.getSession().getMaster()
+  startEndpoint([(0.4, "link up")])
+
+  yield master.expect(AllOf([Expected('ep0', "link up", 5), Expected('ep0', "stream started", 0.6)]))
+  base.testComplete(reactor)
+
+@inlineCallbacks
+def stopsOnCriticalError(args):
+  """ Hits a critical error, which stops only this test
+  """
+  master = base.getSession().getMaster()
+  ep0 = startEndpoint([(0.8, "assertion failed")])
+  ep0.registerErrorPattern("assertion failed", critical=True)
+
+  yield master.expect(Expected('ep0', "stream started", 5))
+  base.testComplete(reactor)
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  args = parser.parse_args()
+
+  xmos_logging.configure_logging(level_file='DEBUG', filename=args.logfile)
+
+  sessions = base.testStartSessions([('passes', passes), ('times_out', timesOut),
+                                     ('critical', stopsOnCriticalError)], args)
+
+  for session in sessions:
+    summary = session.getSummary()
+    xmos_logging.log_info("%s %s with %d error(s)" % (summary['name'],
+        'PASSED' if summary['passed'] else 'FAILED', summary['errors']))
+
+  # Only sessions which may have processes running are kept for testShutdown
+  xmos_logging.log_info("%d session(s) tracked" % len(base.getSessions()))
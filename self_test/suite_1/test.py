@@ -0,0 +1,88 @@
+import sys
+import os
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import xmos.test.process as process
+import xmos.test.base as base
+import xmos.test.suite as suite
+import xmos.test.xmos_logging as xmos_logging
+from xmos.test.base import AllOf, Expected
+
+class FakeEndpoint(process.Process):
+  """ An endpoint which acknowledges each command sent to it rather than
+    running a real program
+  """
+  def sendLine(self, command):
+    reactor.callLater(0.05, self.errReceived, "ack %s\n" % command)
+
+  def kill(self):
+    xmos_logging.log_info("%s: killed" % self.name)
+    self.ended = True
+
+def startEndpoint(name):
+  def start(master):
+    ep = FakeEndpoint(name, master)
+    reactor.callLater(0.1, ep.errReceived, "%s booted\n" % name)
+    return ep
+  return start
+
+@inlineCallbacks
+def resetEndpoints(args):
+  """ Suite setUp: make sure every endpoint is ready for the next test
+  """
+  master = base.getSession().getMaster()
+  for name in master.processes:
+    master.sendLine(name, "reset")
+  yield master.expect(AllOf([Expected(name, "ack reset", 5) for name in master.processes]))
+
+@inlineCallbacks
+def play(args):
+  master = base.getSession().getMaster()
+  master.sendLine('ep0', "play")
+  yield master.expect(Expected('ep0', "ack play", 5))
+  base.testComplete(reactor)
+
+@inlineCallbacks
+def timesOut(args):
+  master = base.getSession().getMaster()
+  yield master.expect(Expected('ep1', "stream started", 0.3))
+  base.testComplete(reactor)
+
+def raises(args):
+  raise RuntimeError("test went wrong")
+
+def stopStream(args):
+  xmos_logging.log_info("stopping stream")
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  args = parser.parse_args()
+
+  xmos_logging.configure_logging(level_file='DEBUG', filename=args.logfile)
+
+  tests = suite.Suite(setUp=resetEndpoints, timeout=10)
+  tests.addEndpoint('ep0', startEndpoint('ep0'), restart=suite.RESTART_ON_FAILURE)
+  tests.addEndpoint('ep1', startEndpoint('ep1'), restart=suite.RESTART_NEVER)
+  tests.addTest('play', play)
+  tests.addTest('times_out', timesOut, tearDown=stopStream)
+  tests.addTest('play_again', play)
+  tests.addTest('raises', raises)
+  tests.addTest('play_last', play)
+
+  tests.run(args)
+
+  for endpoint in tests.endpoints:
+    xmos_logging.log_info("%s started %d time(s)" % (endpoint.name, endpoint.starts))
+
+  # The suite keeps the endpoints which are still running
+  xmos_logging.log_info("%d session(s) tracked" % len(base.getSessions()))
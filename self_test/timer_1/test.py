@@ -0,0 +1,47 @@
+import sys
+import os
+
+from twisted.internet import reactor
+
+def get_parent(full_path):
+  (parent, file) = os.path.split(full_path)
+  return parent
+
+# Configure the path so that the test framework will be found
+rootDir = get_parent(get_parent(get_parent(get_parent(os.path.realpath(__file__)))))
+sys.path.append(os.path.join(rootDir,'test_framework'))
+
+import xmos.test.base as base
+import xmos.test.xmos_logging as xmos_logging
+from xmos.test.timer import TimerWheel
+
+def fails():
+  raise ValueError("timeout handler failed")
+
+def fires(name):
+  xmos_logging.log_info("%s fired" % name)
+
+def done():
+  xmos_logging.log_info("%d timers pending" % wheel.getPendingCount())
+  reactor.stop()
+
+if __name__ == "__main__":
+  parser = base.getParser()
+  args = parser.parse_args()
+
+  xmos_logging.configure_logging(level_file='DEBUG', filename=args.logfile)
+
+  # The timers after the one which raises still fire, both in the same tick
+  # and in later ones
+  wheel = TimerWheel()
+  wheel.callLater(0.1, fires, 'first')
+  wheel.callLater(0.2, fails)
+  wheel.callLater(0.2, fires, 'same tick')
+  wheel.callLater(0.5, fires, 'later')
+  wheel.callLater(0.8, done)
+
+  # Stop even if the wheel stops firing
+  stop = reactor.callLater(5, reactor.stop)
+  reactor.run()
+  if stop.active():
+    stop.cancel()
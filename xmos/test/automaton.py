@@ -0,0 +1,377 @@
+import bisect
+import collections
+from xmos.test.base import *
+
+""" Compiles an expectation tree (Expected, AllOf, OneOf, NoneOf, Sequence)
+    into flat tables so that a line only visits the leaves that are waiting
+    on its process.
+
+    The nodes of the tree are numbered in the order the interpreted tree
+    visits them, which gives every node a range of numbers covering its
+    sub-tree. The compiled form keeps, for each process, the sorted numbers
+    of the leaves that can currently match a line from it. A line is checked
+    against those leaves only, and the rules of each combinator are applied
+    along the path from a leaf that reacts up to the root. The tree objects
+    are updated exactly as the interpreted completes() would update them, so
+    a compiled tree can be used anywhere the tree itself is used and gives
+    the same results.
+
+    The tables only depend on the shape of the tree, so they are cached and
+    shared by trees that are rebuilt with the same shape, for example on
+    every iteration of a soak test.
+
+    The cache only saves building those tables. Compiling a tree still
+    flattens and numbers every node and builds the active leaves, so each
+    expect of a new tree costs time in proportion to the size of the tree,
+    as does a line from ANY_PROCESS. Compiling pays off when a tree waits on
+    many lines, not for trees which are built and then met by a line or two.
+"""
+
+LEAF, ALL_OF, ONE_OF, NONE_OF, SEQUENCE = range(5)
+
+# The parts of an ExpectedResult as bits
+COMPLETED = 1
+STARTED = 2
+TIMEDOUT = 4
+CONSUME = 8
+
+def resultFlags(result):
+  return ((result.completed and COMPLETED) | (result.started and STARTED) |
+          (result.timedout and TIMEDOUT) | (result.consume and CONSUME))
+
+def getKind(node):
+  # NoneOf and OneOf are checked before any of their possible base classes
+  for (cls, kind) in ((Expected, LEAF), (NoneOf, NONE_OF), (OneOf, ONE_OF),
+                      (AllOf, ALL_OF), (Sequence, SEQUENCE)):
+    if isinstance(node, cls):
+      return kind
+  raise TypeError("cannot compile %s" % node.__class__.__name__)
+
+def flatten(tree):
+  """ Returns the nodes of a tree in the order they are visited, along with the
+    signature which describes the shape of the tree.
+  """
+  nodes = []
+  signature = []
+  seen = set()
+  stack = [tree]
+  while stack:
+    node = stack.pop()
+    if id(node) in seen:
+      raise ValueError("cannot compile a tree which contains %r more than once" % node)
+    seen.add(id(node))
+
+    kind = getKind(node)
+    nodes.append(node)
+    if kind == LEAF:
+      signature.append((kind, node.process))
+      continue
+
+    members = list(node.l) if kind == SEQUENCE else list(node.s)
+    if not members:
+      # Empty combinators complete without any line so are left interpreted
+      raise ValueError("cannot compile an empty %s" % node.__class__.__name__)
+    signature.append((kind, len(members)))
+    stack.extend(reversed(members))
+  return (nodes, tuple(signature))
+
+
+class Program(object):
+  """ The tables for one shape of tree. Nodes are numbered in visiting order.
+
+    kinds:     the kind of each node
+    parents:   the parent of each node, None for the root
+    ends:      one past the last node in the sub-tree of each node
+    children:  the children of each node
+  """
+  def __init__(self, signature):
+    count = len(signature)
+    self.kinds = [ kind for (kind, arg) in signature ]
+    self.parents = [None] * count
+    self.ends = [None] * count
+    self.children = [ [] for n in range(count) ]
+
+    # Open nodes and the number of children each still has to be given
+    stack = []
+    for (n, (kind, arg)) in enumerate(signature):
+      if stack:
+        parent = stack[-1][0]
+        self.parents[n] = parent
+        self.children[parent].append(n)
+        stack[-1][1] -= 1
+      if kind == LEAF:
+        self.ends[n] = n + 1
+      else:
+        stack.append([n, arg])
+      while stack and not stack[-1][1]:
+        self.ends[stack.pop()[0]] = n + 1
+
+  def childOf(self, node, leaf):
+    """ Returns the child of node on the path down to leaf
+    """
+    parents = self.parents
+    while parents[leaf] != node:
+      leaf = parents[leaf]
+    return leaf
+
+
+class ProgramCache(object):
+  """ A bounded LRU cache of the programs for each shape of tree
+  """
+  def __init__(self, size=64):
+    self.size = size
+    self.programs = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, signature):
+    try:
+      program = self.programs.pop(signature)
+      self.hits += 1
+    except KeyError:
+      program = Program(signature)
+      self.misses += 1
+      if len(self.programs) >= self.size:
+        self.programs.popitem(last=False)
+    self.programs[signature] = program
+    return program
+
+  def clear(self):
+    self.programs.clear()
+    self.hits = 0
+    self.misses = 0
+
+  def getCounts(self):
+    return { 'hits' : self.hits, 'misses' : self.misses, 'entries' : len(self.programs) }
+
+
+program_cache = ProgramCache()
+
+def compileExpected(tree, cache=True):
+  """ Returns the compiled form of an expectation tree. Trees which are already
+    compiled, or can't be compiled, are returned unchanged.
+  """
+  if isinstance(tree, CompiledExpected):
+    return tree
+  try:
+    (nodes, signature) = flatten(tree)
+  except (TypeError, ValueError) as e:
+    log_debug("not compiling expected: %s", e)
+    return tree
+  program = program_cache.get(signature) if cache else Program(signature)
+  return CompiledExpected(tree, program, nodes)
+
+
+class CompiledExpected(Waitable):
+  """ An expectation tree driven by its compiled tables. Wraps the tree so that
+    it can be given to the master in place of the tree.
+  """
+  def __init__(self, tree, program, nodes):
+    self.tree = tree
+    self.program = program
+    self.nodes = nodes
+    self.numbers = dict((id(node), n) for (n, node) in enumerate(nodes))
+    self.processes = tree.processes
+    self.refresh()
+
+  def refresh(self):
+    """ Rebuild the tables of active leaves from the state of the tree
+    """
+    # Map of process to the sorted numbers of its active leaves
+    self.active = {}
+
+    # Sorted numbers of the active leaves which have timed out. These react to
+    # lines from any process.
+    self.timedout = []
+    self.activate(0)
+
+  def activate(self, n):
+    """ Add the active leaves in the sub-tree of node n to the tables
+    """
+    program = self.program
+    stack = [n]
+    while stack:
+      n = stack.pop()
+      node = self.nodes[n]
+      kind = program.kinds[n]
+      if kind == LEAF:
+        bisect.insort(self.active.setdefault(node.process, []), n)
+        if node.timedout:
+          bisect.insort(self.timedout, n)
+      elif kind == SEQUENCE:
+        if node.l:
+          stack.append(self.numbers[id(node.l[0])])
+      else:
+        for c in program.children[n]:
+          if self.nodes[c] in node.s:
+            stack.append(c)
+
+  def deactivate(self, n):
+    """ Remove the leaves in the sub-tree of node n from the tables
+    """
+    end = self.program.ends[n]
+    for leaves in self.active.values() + [self.timedout]:
+      del leaves[bisect.bisect_left(leaves, n):bisect.bisect_left(leaves, end)]
+
+  def getCandidates(self, process):
+    """ Returns the numbers of the leaves which can react to a line from the
+      process, in visiting order.
+    """
+    leaves = self.active.get(process, [])
+    if not self.timedout:
+      return list(leaves)
+    return sorted(set(leaves) | set(self.timedout))
+
+  def getProcesses(self):
+    return self.tree.getProcesses()
+
+  def canReact(self, process):
+    return self.tree.canReact(process)
+
+  def getActiveEvents(self):
+    nodes = self.nodes
+    return [ nodes[n] for leaves in self.active.values() for n in leaves ]
+
+  def registerTimeouts(self, master):
+    self.tree.registerTimeouts(master)
+
+  def cancelTimeouts(self):
+    self.tree.cancelTimeouts()
+
+  def completes(self, process, string):
+    if process == ANY_PROCESS:
+      # Every leaf is visited so there is nothing to gain from the tables
+      result = self.tree.completes(process, string)
+      self.refresh()
+      return result
+
+    candidates = self.getCandidates(process)
+
+    # The number of candidates before each one which react to the line
+    nodes = self.nodes
+    counts = [0]
+    reacting = 0
+    for n in candidates:
+      leaf = nodes[n]
+      if leaf.timedout or leaf.matchesLine(process, string):
+        reacting += 1
+      counts.append(reacting)
+
+    flags = self.visit(0, process, string, candidates, counts, 0, len(candidates))
+    return getResult(flags & COMPLETED, flags & STARTED, flags & TIMEDOUT, flags & CONSUME)
+
+  def visit(self, n, process, string, candidates, counts, lo, hi):
+    """ Apply a line to node n, where candidates[lo:hi] are the leaves in its
+      sub-tree which can react to it. Returns the result as flags.
+    """
+    if counts[hi] == counts[lo]:
+      self.skip(n, string, candidates, lo, hi)
+      return 0
+
+    kind = self.program.kinds[n]
+    node = self.nodes[n]
+    if kind == LEAF:
+      return resultFlags(node.completes(process, string))
+    if kind == SEQUENCE:
+      return self.visitSequence(node, process, string, candidates, counts, lo, hi)
+
+    program = self.program
+    ends = program.ends
+    flags = 0
+    to_remove = []
+    i = lo
+    while i < hi:
+      # The candidates in the sub-tree of the next child that has any. Children
+      # without candidates would not react to the line.
+      c = program.childOf(n, candidates[i])
+      (start, i) = (i, bisect.bisect_left(candidates, ends[c], i + 1, hi))
+      event = self.nodes[c]
+      if event not in node.s or not event.canReact(process):
+        continue
+
+      eventFlags = self.visit(c, process, string, candidates, counts, start, i)
+
+      if kind == NONE_OF:
+        if eventFlags & (COMPLETED | STARTED):
+          node.errorFn("Seen NoneOf event %s:\n   Pattern: %s\n   Actual: %s" % (event.process, event.pattern, string), critical=node.critical)
+          node.cancelTimeouts()
+          node.removeEvents(list(node.s))
+          self.deactivate(n)
+          break
+        if eventFlags & TIMEDOUT:
+          to_remove.append(event)
+        continue
+
+      flags |= eventFlags & (STARTED | TIMEDOUT | CONSUME)
+      if kind == ALL_OF:
+        if eventFlags & (COMPLETED | TIMEDOUT):
+          node.removeEvents([event])
+          self.deactivate(c)
+        if eventFlags & (COMPLETED | STARTED | TIMEDOUT):
+          break
+      elif eventFlags & (COMPLETED | TIMEDOUT):
+        to_remove = list(node.s)
+        break
+      elif eventFlags & STARTED:
+        to_remove = [ e for e in node.s if e is not event ]
+        break
+
+    node.removeEvents(to_remove)
+    for event in to_remove:
+      event.cancelTimeouts()
+      self.deactivate(self.numbers[id(event)])
+
+    if kind == NONE_OF:
+      flags = 0
+    if not node.s:
+      flags |= COMPLETED
+    return flags
+
+  def skip(self, n, string, candidates, lo, hi):
+    """ Nothing in the sub-tree of node n reacts to the line, so it is only
+      recorded as the last line checked by the leaves that would be visited.
+    """
+    nodes = self.nodes
+    for k in xrange(lo, hi):
+      nodes[candidates[k]].prevLine = string
+
+    # Sequences check their first event without asking whether it can react
+    kinds = self.program.kinds
+    while kinds[n] == SEQUENCE:
+      n = self.numbers[id(nodes[n].l[0])]
+    if kinds[n] == LEAF:
+      nodes[n].prevLine = string
+
+  def visitSequence(self, node, process, string, candidates, counts, lo, hi):
+    assert node.l
+    head = node.l[0]
+    h = self.numbers[id(head)]
+
+    # Only the first event can react so only its candidates are visited
+    i = bisect.bisect_left(candidates, h, lo, hi)
+    j = bisect.bisect_left(candidates, self.program.ends[h], i, hi)
+    eventFlags = self.visit(h, process, string, candidates, counts, i, j)
+    flags = eventFlags & (STARTED | CONSUME)
+
+    if eventFlags & COMPLETED:
+      head.cancelTimeouts()
+
+    if eventFlags & (COMPLETED | TIMEDOUT):
+      node.l.popleft()
+      self.deactivate(h)
+
+      if node.l:
+        if node.master:
+          # Enable time out of the next event in the sequence
+          node.l[0].registerTimeouts(node.master)
+        self.activate(self.numbers[id(node.l[0])])
+
+    if not node.l:
+      flags |= COMPLETED | (eventFlags & TIMEDOUT)
+    return flags
+
+  def __str__(self):
+    return str(self.tree)
+
+  def __repr__(self):
+    return repr(self.tree)
@@ -1,8 +1,11 @@
 from twisted.internet import reactor
 from twisted.internet import defer
+from twisted.internet import task
 import argparse
+import collections
 import datetime
 import functools
+import itertools
 import os
 import re
 import sys
@@ -13,37 +16,39 @@ import threading
 from contextlib import contextmanager
 
 from xmos.test.xmos_logging import *
+from xmos.test.log_writer import syncLogWriters, closeLogWriters
+import xmos.test.profiler as profiler
+from xmos.test.session import Session, getSession, getSessions, defaultSession
 _tls = threading.local()
 
 LOG_ENABLED = False
-log_indent = 1
 
 def log_completes_start(entity):
-  global log_indent
   if not LOG_ENABLED:
     return
 
-  log_debug("%s%s" % ("  "*log_indent, entity.__class__.__name__))
-  log_indent += 1
+  session = getSession()
+  log_debug("%s%s" % ("  "*session.completes_indent, entity.__class__.__name__))
+  session.completes_indent += 1
 
 def log_completes_end(entity, result):
-  global log_indent
   if not LOG_ENABLED:
     return
 
-  log_debug("%s%s: %s" % ("  "*log_indent, entity.__class__.__name__, result))
-  assert(log_indent > 0)
-  log_indent -= 1
+  session = getSession()
+  log_debug("%s%s: %s" % ("  "*session.completes_indent, entity.__class__.__name__, result))
+  assert(session.completes_indent > 0)
+  session.completes_indent -= 1
 
 def log_completes_expected(expected, process, string, result):
-  global log_indent
   if not LOG_ENABLED:
     return
 
-  log_debug("%s%s: '%s:%s...' match '%s:%s...' ? %s" % ("  "*log_indent, expected.__class__.__name__,
+  session = getSession()
+  log_debug("%s%s: '%s:%s...' match '%s:%s...' ? %s" % ("  "*session.completes_indent, expected.__class__.__name__,
       expected.process, expected.pattern[0:10], process, string[0:10], result))
-  assert(log_indent > 0)
-  log_indent -= 1
+  assert(session.completes_indent > 0)
+  session.completes_indent -= 1
 
 
 @contextmanager
@@ -54,6 +59,14 @@ def _nested():
   finally:
     _tls.level -= 1
 
+def _slotItems(obj):
+  """ The attributes of an object which uses __slots__, in declaration order
+  """
+  for cls in reversed(type(obj).__mro__):
+    for name in getattr(cls, '__slots__', ()):
+      if hasattr(obj, name):
+        yield (name, getattr(obj, name))
+
 @contextmanager
 def _recursion_lock(obj):
   if not hasattr(_tls, "history"):
@@ -68,22 +81,72 @@ def _recursion_lock(obj):
     _tls.history.pop(-1)
 
 
-""" Global list of all active processes
+""" Global list of all active processes. These are the processes of the
+  default session, other sessions have their own (see session.py).
+"""
+activeProcesses = defaultSession.processes
+
+""" Process name used to offer a line to every expected regardless of which
+  process it is waiting on. This is how timed out events are cleared.
 """
-activeProcesses = {}
+ANY_PROCESS = 'invalid'
 
 defaultToCriticalFailure = False
 
+""" The clock used for sleeps and timeouts. This is the reactor unless the test
+  is being run in virtual time.
+"""
+_clock = reactor
+
+def getClock():
+  return _clock
+
+def setClock(clock):
+  """ Set the clock used by sleep() and by any Master created afterwards.
+    Passing None restores the reactor.
+  """
+  global _clock
+  _clock = clock or reactor
+
+class VirtualClock(task.Clock):
+  """ A clock for running tests in virtual time. Time only moves when the
+    clock is advanced, and can jump straight to the next sleep or timeout so
+    that tests with long timeouts run as quickly as their input allows.
+  """
+  def getNextTime(self):
+    """ Returns the time of the next pending call, or None if there are none
+    """
+    return self.calls[0].getTime() if self.calls else None
+
+  def advanceTo(self, when):
+    """ Move time forward to when, running each call due on the way at the
+      time it was due.
+    """
+    while self.calls and self.calls[0].getTime() <= when:
+      self.advance(max(0, self.calls[0].getTime() - self.seconds()))
+    if when > self.seconds():
+      self.advance(when - self.seconds())
+
+  def runUntilIdle(self, limit=None):
+    """ Keep jumping to the next pending call until there are none left or
+      the next is after limit.
+    """
+    while self.calls and (limit is None or self.calls[0].getTime() <= limit):
+      self.advanceTo(self.calls[0].getTime())
+
 def sleep(secs):
   """ A sleep function to be used within tests. Called using yield, eg:
         yield base.sleep(1)
   """
   d = defer.Deferred()
-  reactor.callLater(secs, d.callback, None)
+  # Resume the test in the session which is sleeping
+  _clock.callLater(secs, getSession().call, d.callback, None)
   return d
 
 def getActiveProcesses():
-  return activeProcesses
+  """ Returns the processes of the current session
+  """
+  return getSession().processes
 
 def file_abspath(filename):
   """ Given a search path, find whether a file exists
@@ -106,9 +169,14 @@ def testShutdown():
     and then killing the process tree to ensure child processes
     are killed.
   """
-  for name,process in getActiveProcesses().iteritems():
-    if (process.transport):
-      process.transport.loseConnection()
+  for session in getSessions():
+    for name,process in session.processes.iteritems():
+      if (process.transport):
+        process.transport.loseConnection()
+      process.output_history.close()
+
+  # Make sure the process logs are complete before anything is killed
+  closeLogWriters()
 
   if sys.platform.startswith("win"):
     import psutil
@@ -124,8 +192,85 @@ def testShutdown():
     signal.signal(signal.SIGINT, signal.SIG_IGN)
     os.kill(-os.getpgid(os.getpid()), signal.SIGINT)
 
+# Characters which make a pattern more than a plain string
+_metacharacters = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+def isLiteral(pattern):
+  return not _metacharacters.search(pattern)
+
+class LiteralPattern(object):
+  """ A plain string pattern which is matched with a substring search. Provides
+    the parts of the compiled pattern interface used by the framework.
+  """
+  groups = 0
+
+  def __init__(self, pattern):
+    self.pattern = pattern
+
+  def search(self, string):
+    return self.pattern in string
+
+  def __repr__(self):
+    return "LiteralPattern(%r)" % self.pattern
+
+
+class PatternCache(object):
+  """ A bounded LRU cache of compiled patterns shared by all expected values
+    and error patterns. The re module's own cache is small and is flushed
+    completely when full, so tests with many patterns end up recompiling
+    them on every line.
+  """
+  def __init__(self, size=1024):
+    self.size = size
+    self.patterns = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.literals = 0
+
+  def compile(self, pattern, literal=False):
+    """ Return the compiled form of a pattern, compiling it if it isn't
+      already in the cache. Patterns without any regular expression
+      metacharacters, or those marked as literal, use a substring search.
+    """
+    key = (pattern, literal)
+    try:
+      compiled = self.patterns.pop(key)
+      self.hits += 1
+    except KeyError:
+      if literal or isLiteral(pattern):
+        compiled = LiteralPattern(pattern)
+        self.literals += 1
+      else:
+        compiled = re.compile(pattern)
+      self.misses += 1
+      if len(self.patterns) >= self.size:
+        self.patterns.popitem(last=False)
+    self.patterns[key] = compiled
+    return compiled
+
+  def clear(self):
+    self.patterns.clear()
+    self.hits = 0
+    self.misses = 0
+    self.literals = 0
+
+  def getCounts(self):
+    return { 'hits' : self.hits, 'misses' : self.misses, 'literals' : self.literals,
+             'entries' : len(self.patterns) }
+
+
+pattern_cache = PatternCache()
+
+def compilePattern(pattern, literal=False):
+  """ Get a compiled pattern from the shared pattern cache. Anything that has
+    already been compiled is returned unchanged.
+  """
+  if hasattr(pattern, 'search'):
+    return pattern
+  return pattern_cache.compile(pattern, literal)
+
 def matchesPattern(pattern, string):
-  m = re.search(pattern, string)
+  m = compilePattern(pattern).search(string)
   if m:
     return True
   else:
@@ -181,25 +326,83 @@ def testTimeoutIgnore(process, pattern, timeout, errorFn, critical=None):
   return False
 
 def testError(reason="", critical=False):
+  session = getSession()
+  session.error_count += 1
   test_state.error_count += 1
   log_error("%s" % reason)
-  if critical and test_state.reactor_running:
+  syncLogWriters(critical)
+  if critical and session is not defaultSession:
+    # Only the test running in this session is stopped
+    session.complete()
+  elif critical and test_state.reactor_running:
     test_state.reactor_running = False
     reactor.stop()
 
 def testStart(testFunction, args):
+  runReactor(functools.partial(testFunction, args), args)
+
+def runReactor(start, args):
+  """ Run the reactor until the test stops it, calling start() once it is
+    running. The reactor can only be run once.
+  """
   test_state.stopped = False
 
+  if getattr(args, 'profile', None):
+    profiler.enable(args.profile)
+
   # Register a callback to ensure that all processes are killed before exiting
   reactor.addSystemEventTrigger('before', 'shutdown', testShutdown)
 
   # Register test program to run on startup
-  reactor.callWhenRunning(testFunction, args)
+  reactor.callWhenRunning(start)
   test_state.reactor_running = True
   reactor.run()
 
 def testComplete(reactor):
+  session = getSession()
+  if session is not defaultSession:
+    # The reactor is stopped by testStartSessions once all sessions complete
+    session.complete()
+    return
+
   print_status_summary()
+  profiler.dump()
+  if test_state.reactor_running:
+    test_state.reactor_running = False
+    reactor.stop()
+
+def testStartSessions(tests, args):
+  """ Run several tests at once in the one reactor. Each test is given as
+    a (name, testFunction) pair and runs in a Session of that name, with its
+    own processes, master and error counts. Each testFunction is called with
+    args, as for testStart, and should create its master and processes
+    itself, for example using getSession().getMaster(). It calls
+    testComplete(reactor) when it is done, which completes its session.
+
+    The reactor is stopped once every session has completed. Returns the
+    sessions in the order of the tests.
+  """
+  sessions = [ Session(name) for (name, testFunction) in tests ]
+
+  def startAll():
+    for (session, (name, testFunction)) in zip(sessions, tests):
+      session.start(testFunction, args)
+    done = defer.DeferredList([ session.getDeferred() for session in sessions ])
+    done.addCallback(lambda results: sessionsComplete(sessions))
+
+  runReactor(startAll, args)
+  return sessions
+
+def sessionsComplete(sessions):
+  """ Report the result of all the sessions and stop the reactor
+  """
+  failed = [ session.name for session in sessions if not session.passed() ]
+  with defaultSession:
+    if failed:
+      log_info("%d of %d tests failed: %s" % (len(failed), len(sessions), ", ".join(failed)))
+    else:
+      log_info("All %d tests passed" % len(sessions))
+  profiler.dump()
   if test_state.reactor_running:
     test_state.reactor_running = False
     reactor.stop()
@@ -207,7 +410,7 @@ def testComplete(reactor):
 
 class TestState(object):
   """ Keep track of test state as it runs. Currently this is:
-      - number of errors seen
+      - number of errors seen, in all sessions
   """
   error_count = 0
 
@@ -217,11 +420,70 @@ class TestState(object):
   reactor_running = False
 
 
+# Marks the place of an item removed from an OrderedSet
+_removed = object()
+
+class OrderedSet(collections.MutableSet):
+  """ A set which iterates in the order the items were added, so that the
+    children of a combinator are always tried in the same order.
+
+    Removing an item leaves a hole in the list of items, which is closed up
+    once the list is mostly holes, so removal takes constant time.
+  """
+  __slots__ = ('items', 'index')
+
+  def __init__(self, iterable=()):
+    self.items = []
+    self.index = {}
+    for item in iterable:
+      self.add(item)
+
+  def __contains__(self, item):
+    return item in self.index
+
+  def __len__(self):
+    return len(self.index)
+
+  def __iter__(self):
+    for item in self.items:
+      if item is not _removed:
+        yield item
+
+  def add(self, item):
+    if item not in self.index:
+      self.index[item] = len(self.items)
+      self.items.append(item)
+
+  def discard(self, item):
+    i = self.index.pop(item, None)
+    if i is None:
+      return
+    self.items[i] = _removed
+    if len(self.items) > 2 * len(self.index) + 16:
+      self.items = [ x for x in self.items if x is not _removed ]
+      self.index = dict((x, i) for (i, x) in enumerate(self.items))
+
+  def __repr__(self):
+    return "OrderedSet(%r)" % list(self)
+
+
 class Waitable(object):
+  __slots__ = ()
 
   def getProcesses(self):
     raise NotImplementedError("Should have implemented this")
 
+  def canReact(self, process):
+    """ Returns whether a line from the process could affect this waitable.
+      Used to avoid visiting sub-trees that are only waiting on other processes.
+    """
+    raise NotImplementedError("Should have implemented this")
+
+  def getActiveEvents(self):
+    """ Returns the Expected leaves that can currently match a line.
+    """
+    raise NotImplementedError("Should have implemented this")
+
   def registerTimeouts(self, master):
     raise NotImplementedError("Should have implemented this")
 
@@ -233,8 +495,18 @@ class Waitable(object):
 
 
 class SetBasedWaitable(Waitable):
+  __slots__ = ('s', 'process_counts', 'processes')
+
   def __init__(self, l):
-    self.s = set(l)
+    self.s = OrderedSet(l)
+
+    # The processes that any of the remaining events could react to, along with
+    # the number of events waiting on each process
+    self.process_counts = {}
+    for event in self.s:
+      for process in event.processes:
+        self.process_counts[process] = self.process_counts.get(process, 0) + 1
+    self.processes = frozenset(self.process_counts)
 
   def getProcesses(self):
     processes = set()
@@ -242,6 +514,27 @@ class SetBasedWaitable(Waitable):
       processes |= event.getProcesses()
     return processes
 
+  def canReact(self, process):
+    return process == ANY_PROCESS or process in self.process_counts
+
+  def getActiveEvents(self):
+    events = []
+    for event in self.s:
+      events += event.getActiveEvents()
+    return events
+
+  def removeEvents(self, events):
+    """ Remove the events from the set and stop dispatching lines to them.
+    """
+    for event in events:
+      self.s.discard(event)
+      for process in event.processes:
+        count = self.process_counts[process] - 1
+        if count:
+          self.process_counts[process] = count
+        else:
+          del self.process_counts[process]
+
   def registerTimeouts(self, master):
     assert self.s
 
@@ -256,7 +549,7 @@ class SetBasedWaitable(Waitable):
     if getattr(_tls, "level", 0) > 0:
       return str(self)
     else:
-      attrs = ", ".join("%s = %r" % (k, v) for k, v in self.__dict__.items())
+      attrs = ", ".join("%s = %r" % (k, v) for k, v in _slotItems(self))
       return "%s(%s)" % (self.__class__.__name__, attrs)
 
   def __str__(self):
@@ -277,6 +570,7 @@ class SetBasedWaitable(Waitable):
 
 
 class ExpectedResult(object):
+  __slots__ = ('completed', 'started', 'timedout', 'consume')
 
   def __init__(self, completed=False, started=False, timedout=False, consume=False):
     self.completed = completed
@@ -290,16 +584,57 @@ class ExpectedResult(object):
   def __repr__(self):
     return "(%s, %s, %s, %s)" % (self.completed, self.started, self.timedout, self.consume)
 
+
+class SharedResult(ExpectedResult):
+  """ A result which is shared by every caller so can't be modified. Returned
+    by getResult() so that checking a line doesn't allocate any results.
+  """
+  __slots__ = ()
+
+  def __init__(self, *values):
+    for (name, value) in zip(ExpectedResult.__slots__, values):
+      object.__setattr__(self, name, value)
+
+  def __setattr__(self, name, value):
+    raise AttributeError("shared results can't be modified")
+
+_results = dict((values, SharedResult(*values))
+                for values in itertools.product((False, True), repeat=4))
+
+def getResult(completed=False, started=False, timedout=False, consume=False):
+  """ Returns the shared result with the given values
+  """
+  return _results[(bool(completed), bool(started), bool(timedout), bool(consume))]
+
+NO_RESULT = getResult()
+TIMED_OUT = getResult(timedout=True)
+
+
+# The processes of an Expected, shared by all those waiting on the same process
+_process_sets = {}
+
+def processSet(process):
+  try:
+    return _process_sets[process]
+  except KeyError:
+    return _process_sets.setdefault(process, frozenset([process]))
+
+
 class Expected(Waitable):
+  __slots__ = ('process', 'processes', 'pattern', 'regex', 'timeout', 'timeoutTime',
+               'func', 'timedout', 'errorFn', 'critical', 'completionFn',
+               'completionArgs', 'prevLine', 'consumeOnMatch', 'matcher', 'master')
 
   def __init__(self, process, pattern, timeoutTime=0, func=testTimeout,
                errorFn=testError, critical=None,
                completionFn=None, completionArgs=None,
-               consumeOnMatch=False):
+               consumeOnMatch=False, literal=False):
     if critical == None:
       critical = defaultToCriticalFailure
     self.process = process
+    self.processes = processSet(process)
     self.pattern = pattern
+    self.regex = compilePattern(pattern, literal)
     self.timeout = None
     self.timeoutTime = timeoutTime
     self.func = func
@@ -311,22 +646,41 @@ class Expected(Waitable):
     self.prevLine = ""
     self.consumeOnMatch = consumeOnMatch
 
+    # The matcher for the process, set by the master while this is active
+    self.matcher = None
+    self.master = None
+
   def getPrevLine(self):
     return self.prevLine
 
   def getProcesses(self):
     return set([self.process])
 
+  def canReact(self, process):
+    return process == ANY_PROCESS or process == self.process or self.timedout
+
+  def getActiveEvents(self):
+    return [self]
+
+  def matchesLine(self, process, string):
+    if process != self.process:
+      return False
+
+    if self.matcher:
+      return self.matcher.matches(self.regex, string)
+
+    return matchesPattern(self.regex, string)
+
   def registerTimeouts(self, master):
     if self.timeoutTime > 0:
-      now = datetime.datetime.now()
-      log_debug("%s: Register timeout %s: %s %.1f" % (now.time(), self.process, self.pattern, self.timeoutTime))
-      self.timeout = reactor.callLater(self.timeoutTime, self.timedOut)
+      log_debug(lambda: "%s: Register timeout %s: %s %.1f" % (datetime.datetime.now().time(),
+          self.process, self.pattern, self.timeoutTime))
+      self.timeout = master.timers.callLater(self.timeoutTime, self.timedOut)
       self.master = master
 
   def cancelTimeouts(self):
     if self.timeout:
-      log_debug("Cancel timeout %s: %s" % (self.process, self.pattern))
+      log_debug("Cancel timeout %s: %s", self.process, self.pattern)
       self.timeout.cancel()
       self.timeout = None
 
@@ -337,44 +691,45 @@ class Expected(Waitable):
     self.prevLine = string
 
     if self.timedout:
-      result = ExpectedResult(timedout=True)
+      result = TIMED_OUT
       log_completes_expected(self, process, string, result)
       return result
 
-    if matches(self.process, self.pattern, process, string):
+    if self.matchesLine(process, string):
 
       # Upon completion call the completion hook if it has been registered
       if self.completionFn:
         log_info("Possible match for %s: %s" % (self.process, self.pattern))
         res = self.completionFn(self)
         if res == False:
-          result = ExpectedResult()
+          result = NO_RESULT
           log_completes_expected(self, process, string, result)
           return result
 
       self.cancelTimeouts()
       log_info("Success: seen match for %s: %s" % (self.process, self.pattern))
 
-      result = ExpectedResult(completed=True, started=True, consume=self.consumeOnMatch)
+      result = getResult(completed=True, started=True, consume=self.consumeOnMatch)
       log_completes_expected(self, process, string, result)
       return result
 
-    result = ExpectedResult()
+    result = NO_RESULT
     log_completes_expected(self, process, string, result)
     return result
 
   def timedOut(self):
     assert self.timeout
 
-    # Call the function registered for timeouts
-    done = self.func(self.process, self.pattern, self.timeoutTime,
-                     errorFn=self.errorFn, critical=self.critical)
+    with self.master.session:
+      # Call the function registered for timeouts
+      done = self.func(self.process, self.pattern, self.timeoutTime,
+                       errorFn=self.errorFn, critical=self.critical)
 
-    # Remove the timeout so that we don't try to cancel it when it has fired
-    self.timeout = None
-    self.timedout = True
+      # Remove the timeout so that we don't try to cancel it when it has fired
+      self.timeout = None
+      self.timedout = True
 
-    self.master.timedOut(done)
+      self.master.timedOut(done)
 
   def __repr__(self):
     return "%s: '%s', timeout: %d, %s, %s" % (
@@ -383,6 +738,8 @@ class Expected(Waitable):
 
 
 class AllOf(SetBasedWaitable):
+  __slots__ = ()
+
   def __init__(self, l):
     """ Takes a list of events that all have to be completed
     """
@@ -397,25 +754,30 @@ class AllOf(SetBasedWaitable):
     """
     log_completes_start(self)
 
-    result = ExpectedResult()
+    started = timedout = consume = False
     for event in self.s:
+      if not event.canReact(process):
+        continue
+
       eventResult = event.completes(process, string)
-      result.started |= eventResult.started
-      result.timedout |= eventResult.timedout
-      result.consume |= eventResult.consume
+      started |= eventResult.started
+      timedout |= eventResult.timedout
+      consume |= eventResult.consume
 
       if eventResult.completed or eventResult.timedout:
-        self.s.remove(event)
+        self.removeEvents([event])
 
       if eventResult.completed or eventResult.started or eventResult.timedout:
         break
 
-    result.completed = not self.s
+    result = getResult(not self.s, started, timedout, consume)
     log_completes_end(self, result)
     return result
 
 
 class OneOf(SetBasedWaitable):
+  __slots__ = ()
+
   def __init__(self, l):
     """ Takes a list of events of which only one has to be completed
     """
@@ -432,33 +794,38 @@ class OneOf(SetBasedWaitable):
     """
     log_completes_start(self)
 
-    result = ExpectedResult()
-    to_remove = set()
+    started = timedout = consume = False
+    to_remove = []
     for event in self.s:
+      if not event.canReact(process):
+        continue
+
       eventResult = event.completes(process, string)
-      result.started |= eventResult.started
-      result.timedout |= eventResult.timedout
-      result.consume |= eventResult.consume
+      started |= eventResult.started
+      timedout |= eventResult.timedout
+      consume |= eventResult.consume
 
       if eventResult.completed or eventResult.timedout:
-        to_remove |= self.s
+        to_remove = list(self.s)
         break
 
       if eventResult.started:
-        to_remove |= self.s - set([event])
+        to_remove = [ e for e in self.s if e is not event ]
         break
 
     # Update the contents of the set and cancel timeouts from all events being removed.
-    self.s -= to_remove
+    self.removeEvents(to_remove)
     for event in to_remove:
       event.cancelTimeouts()
 
-    result.completed = not self.s
+    result = getResult(not self.s, started, timedout, consume)
     log_completes_end(self, result)
     return result
 
 
 class NoneOf(SetBasedWaitable):
+  __slots__ = ('critical', 'errorFn')
+
   def __init__(self, l, critical=None, errorFn=testError):
     """ Takes a list of events which should not be seen. Their timeout
       functions need to be changed to not be errors.
@@ -478,44 +845,61 @@ class NoneOf(SetBasedWaitable):
     """
     log_completes_start(self)
 
-    to_remove = set()
-    result = ExpectedResult()
+    to_remove = []
     for event in self.s:
+      if not event.canReact(process):
+        continue
+
       eventResult = event.completes(process, string)
 
       if eventResult.completed or eventResult.started:
         self.errorFn("Seen NoneOf event %s:\n   Pattern: %s\n   Actual: %s" % (event.process, event.pattern, string), critical=self.critical)
         self.cancelTimeouts()
-        self.s.clear()
+        self.removeEvents(list(self.s))
         break
 
       if eventResult.timedout:
-        to_remove |= set([event])
+        to_remove.append(event)
 
     # Update the contents of the set and cancel timeouts from all events being removed.
-    self.s -= to_remove
+    self.removeEvents(to_remove)
     for event in to_remove:
       event.cancelTimeouts()
 
-    result.completed = not self.s
-    result.timedout = False
+    result = getResult(completed=not self.s)
     log_completes_end(self, result)
     return result
 
 
 class Sequence(object):
+  __slots__ = ('l', 'master', 'processes')
+
   def __init__(self, l):
     """ Takes a list of events which must complete in order
     """
-    self.l = l
+    self.l = collections.deque(l)
     self.master = None
 
+    self.processes = frozenset()
+    for event in self.l:
+      self.processes |= event.processes
+
   def getProcesses(self):
     processes = set()
     for event in self.l:
       processes |= event.getProcesses()
     return processes
 
+  def canReact(self, process):
+    """ Only the first event in the sequence can react to lines.
+    """
+    return process == ANY_PROCESS or (bool(self.l) and self.l[0].canReact(process))
+
+  def getActiveEvents(self):
+    if self.l:
+      return self.l[0].getActiveEvents()
+    return []
+
   def registerTimeouts(self, master):
     self.master = master
 
@@ -533,27 +917,25 @@ class Sequence(object):
     """
     log_completes_start(self)
 
-    result = ExpectedResult()
     assert self.l
     eventResult = self.l[0].completes(process, string)
-    result.started = eventResult.started
-    result.consume = eventResult.consume
 
     if eventResult.completed:
       self.l[0].cancelTimeouts()
 
     if eventResult.completed or eventResult.timedout:
-      self.l.pop(0)
+      self.l.popleft()
 
       if self.l and self.master:
         # Enable time out of the next event in the sequence
         self.l[0].registerTimeouts(self.master)
 
-    result.completed = not self.l
+    completed = not self.l
 
     # If the last event completed then return whether that was due to a timeout.
     # Otherwise the sequence hasn't timedout yet.
-    result.timedout = eventResult.timedout if result.completed else False
+    result = getResult(completed, eventResult.started,
+                       eventResult.timedout if completed else False, eventResult.consume)
     log_completes_end(self, result)
     return result
 
@@ -561,7 +943,7 @@ class Sequence(object):
     if getattr(_tls, "level", 0) > 0:
       return str(self)
     else:
-      attrs = ", ".join("%s = %r" % (k, v) for k, v in self.__dict__.items())
+      attrs = ", ".join("%s = %r" % (k, v) for k, v in _slotItems(self))
       return "%s(%s)" % (self.__class__.__name__, attrs)
 
   def __str__(self):
@@ -589,5 +971,7 @@ def getParser():
       action='store_true', help='log file to be used', default='run.log')
   parser.add_argument('--summaryfile', dest='summaryfile',
       nargs='?', help='file to write summary log to', default=None)
+  parser.add_argument('--profile', dest='profile', metavar='FILE',
+      help='write matching profile counters to FILE as JSON', default=None)
   return parser
 
@@ -0,0 +1,273 @@
+import array
+import mmap
+import os
+import sys
+import tempfile
+
+""" Storage for the lines received from a process.
+
+    Lines are addressed by their absolute position in the history. Reading
+    the history is done through views which iterate over a range of
+    positions without copying the lines. Removing a line leaves a tombstone
+    at its position so that the positions of all other lines are unchanged.
+
+    The amount of history held in memory can be limited. Lines which no
+    expected can read any more are dropped, and lines which are still needed
+    can be spilled to an append-only file which is read back through mmap.
+"""
+
+# Approximate cost of holding a line in the history list, on top of the string
+LINE_OVERHEAD = 8
+
+def lineSize(line):
+  return sys.getsizeof(line) + LINE_OVERHEAD
+
+
+class SpillFile(object):
+  """ An append-only file of lines evicted from memory. Lines are read back
+    through a memory map of the file which is extended as the file grows.
+  """
+  def __init__(self, filename=None):
+    self.temporary = filename is None
+    if self.temporary:
+      (fd, filename) = tempfile.mkstemp(suffix='.history')
+      self.file = os.fdopen(fd, 'w+b')
+    else:
+      self.file = open(filename, 'w+b')
+    self.filename = filename
+
+    # Offset of the start of each line, with the end of the file at the end
+    self.offsets = array.array('L', [0])
+    self.map = None
+    self.mapped = 0
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def append(self, lines):
+    self.file.write(''.join(lines))
+    end = self.offsets[-1]
+    for line in lines:
+      end += len(line)
+      self.offsets.append(end)
+
+  def __getitem__(self, index):
+    end = self.offsets[index + 1]
+    if end > self.mapped:
+      self.file.flush()
+      if self.map:
+        self.map.close()
+      self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+      self.mapped = len(self.map)
+    return self.map[self.offsets[index]:end]
+
+  def getSize(self):
+    return self.offsets[-1]
+
+  def close(self):
+    if self.map:
+      self.map.close()
+      self.map = None
+    self.file.close()
+    if self.temporary:
+      os.remove(self.filename)
+
+
+class History(object):
+  """ The lines received from a process.
+
+    Views cover the lines that were present when they were created, less any
+    removed since. A removed line is replaced by None in memory, or recorded
+    in the removed set once it has been spilled. Evicting lines replaces the
+    underlying list so existing views keep reading the old list, and don't
+    see the lines removed after the eviction.
+
+    window: maximum number of bytes of lines to hold in memory, or None for
+            no limit. When it is exceeded the lines before floor() are
+            evicted, followed by the oldest lines if there is a spill file.
+            Without a spill file the window can't be kept to while the floor
+            is low, for example at 0 between expects, and the lines added
+            while it is exceeded are counted in getMemory()['over_window'].
+    spill:  filename of the spill file, True for a temporary file or None
+            to drop evicted lines.
+    floor:  function returning the lowest position that can still be read
+  """
+  def __init__(self, window=None, spill=None, floor=None):
+    self.window = window
+    self.spill_name = spill
+    self.floor = floor
+    self.lines = []
+
+    # Position of the first line held in memory
+    self.offset = 0
+    self.spill = None
+
+    # Positions of removed lines in the spill file, which can't be rewritten
+    self.removed = set()
+
+    self.bytes = 0
+    self.peak_bytes = 0
+
+    # Number of lines added which left more than the window in memory
+    self.over_window = 0
+
+  def __len__(self):
+    return self.offset + len(self.lines)
+
+  def __iter__(self):
+    return (line for (position, line) in self.view())
+
+  def __getitem__(self, position):
+    if position < 0:
+      position += len(self)
+    if position >= self.offset:
+      line = self.lines[position - self.offset]
+      if line is not None:
+        return line
+    elif position >= self.first() and position not in self.removed:
+      return self.spill[position]
+    raise IndexError("history position %d has been removed" % position)
+
+  def __contains__(self, line):
+    return self.find(line) is not None
+
+  def first(self):
+    """ Returns the lowest position which can still be read
+    """
+    if self.spill is not None and len(self.spill):
+      return 0
+    return self.offset
+
+  def append(self, line):
+    """ Add a line and return its position
+    """
+    self.lines.append(line)
+    self.bytes += lineSize(line)
+    if self.bytes > self.peak_bytes:
+      self.peak_bytes = self.bytes
+    if self.window is not None and self.bytes > self.window:
+      self.evict()
+    return len(self) - 1
+
+  def evict(self):
+    """ Reduce the lines held in memory to three quarters of the window.
+    """
+    target = self.window * 3 / 4
+    floor = self.floor() if self.floor else len(self)
+    count = 0
+    freed = 0
+    for line in self.lines:
+      if self.bytes - freed <= target:
+        break
+      if self.offset + count >= floor and self.spill_name is None:
+        # Can't drop lines which may still be needed
+        break
+      if line is not None:
+        freed += lineSize(line)
+      count += 1
+
+    if self.bytes - freed > self.window:
+      self.over_window += 1
+
+    if not count:
+      return
+
+    if self.spill_name is not None:
+      if self.spill is None:
+        self.spill = SpillFile(None if self.spill_name is True else self.spill_name)
+      evicted = self.lines[:count]
+      self.removed.update(self.offset + i for (i, line) in enumerate(evicted) if line is None)
+      self.spill.append([ line or '' for line in evicted ])
+
+    self.lines = self.lines[count:]
+    self.offset += count
+    self.bytes -= freed
+
+  def view(self, start=0, end=None):
+    """ Iterate over (position, line) from start up to end, or the current
+      end of the history.
+    """
+    lines = self.lines
+    offset = self.offset
+    spill = self.spill
+    if end is None:
+      end = offset + len(lines)
+
+    position = max(start, self.first())
+    while position < min(offset, end):
+      if position not in self.removed:
+        yield (position, spill[position])
+      position += 1
+
+    for position in xrange(max(position, offset), end):
+      line = lines[position - offset]
+      if line is not None:
+        yield (position, line)
+
+  def find(self, line, start=0, end=None):
+    """ Return the position of the first occurrence of the line at or after
+      start and before end, or None if there isn't one.
+    """
+    if end is None:
+      end = self.offset + len(self.lines)
+    for (position, data) in self.view(start, min(self.offset, end)):
+      if data == line:
+        return position
+    try:
+      return self.lines.index(line, max(0, start - self.offset), max(0, end - self.offset)) + self.offset
+    except ValueError:
+      return None
+
+  def lineAt(self, position, line):
+    """ Returns whether the line is at the given position
+    """
+    if position is None or position >= len(self):
+      return False
+    if position >= self.offset:
+      return self.lines[position - self.offset] is line
+    return (position >= self.first() and position not in self.removed and
+            self.spill[position] == line)
+
+  def rfind(self, line):
+    """ Return the position of the last occurrence of the line, or None if
+      there isn't one.
+    """
+    for index in xrange(len(self.lines) - 1, -1, -1):
+      if self.lines[index] == line:
+        return self.offset + index
+    for position in xrange(self.offset - 1, self.first() - 1, -1):
+      if position not in self.removed and self.spill[position] == line:
+        return position
+    return None
+
+  def remove(self, position):
+    """ Remove the line at a position, leaving a tombstone in its place
+    """
+    if position >= self.offset:
+      index = position - self.offset
+      self.bytes -= lineSize(self.lines[index])
+      self.lines[index] = None
+    else:
+      self.removed.add(position)
+
+  def clear(self):
+    self.lines = []
+    self.offset = 0
+    self.bytes = 0
+    self.removed = set()
+    self.close()
+
+  def close(self):
+    if self.spill is not None:
+      self.spill.close()
+      self.spill = None
+
+  def getMemory(self):
+    """ Returns the current and peak bytes held in memory, along with the
+      lines held, dropped and spilled and the lines added over the window
+    """
+    return { 'bytes' : self.bytes, 'peak_bytes' : self.peak_bytes,
+             'lines' : len(self.lines), 'dropped' : self.first(),
+             'over_window' : self.over_window,
+             'spilled' : len(self.spill) if self.spill is not None else 0,
+             'spilled_bytes' : self.spill.getSize() if self.spill is not None else 0 }
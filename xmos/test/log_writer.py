@@ -0,0 +1,194 @@
+import atexit
+import os
+import Queue
+import threading
+import time
+from twisted.internet import reactor
+from xmos.test.xmos_logging import *
+
+""" Writes log files from a background thread so that the reactor never waits
+    on the disk.
+
+    Lines are queued and written out in batches. How often the file is synced
+    to disk is chosen when the writer is created:
+
+      'shutdown' - only when the writer is closed
+      'error'    - whenever a test error is reported
+      'lines'    - after every sync_every lines
+      'ms'       - once sync_every milliseconds have passed since the last
+                   sync
+
+    A sync for an error is queued without waiting for it, so the reactor
+    never waits on the disk for an ordinary error. On a critical error
+    every writer is synced, waiting until it is on disk, and all writers
+    are closed by testShutdown.
+"""
+
+SYNC_MODES = ('shutdown', 'error', 'lines', 'ms')
+
+# All writers which have not been closed
+writers = []
+
+class LogWriter(object):
+  """ A log file written by a background thread.
+
+    Writes block once max_queue lines are waiting to be written so that the
+    memory used is bounded.
+  """
+  def __init__(self, filename, sync='error', sync_every=None, max_queue=10000, batch_size=1000):
+    if sync not in SYNC_MODES:
+      raise ValueError("LogWriter: unknown sync mode '%s'" % sync)
+    if sync in ('lines', 'ms') and not sync_every:
+      raise ValueError("LogWriter: sync mode '%s' requires sync_every" % sync)
+
+    self.filename = filename
+    self.sync = sync
+    self.sync_every = sync_every
+    self.batch_size = batch_size
+    self.file = open(filename, 'w')
+    self.queue = Queue.Queue(max_queue)
+    self.closed = False
+
+    # The first error writing the file, which is logged by the reactor thread
+    self.error = None
+    self.error_reported = False
+
+    # Lines written since the last sync and when it happened
+    self.unsynced = 0
+    self.last_sync = time.time()
+
+    self.thread = threading.Thread(target=self.run, name='LogWriter(%s)' % filename)
+    self.thread.daemon = True
+    self.thread.start()
+    writers.append(self)
+
+  def write(self, data):
+    if self.closed:
+      # Output arriving during shutdown is appended directly
+      with open(self.filename, 'a') as f:
+        f.write(data)
+      return
+    self.queue.put(data)
+
+  def flush(self, fsync=True):
+    """ Wait until everything queued so far has been written to the file
+      and, if fsync is set, synced to disk.
+    """
+    if self.closed:
+      return
+    done = threading.Event()
+    self.queue.put((done, fsync))
+    done.wait()
+    self.reportError()
+
+  def requestSync(self):
+    """ Ask for everything queued so far to be synced to disk, without
+      waiting for it to happen.
+    """
+    if self.closed:
+      return
+    self.queue.put((None, True))
+
+  def close(self):
+    """ Write out everything queued, sync the file and stop the thread
+    """
+    if self.closed:
+      return
+    self.closed = True
+    self.queue.put(None)
+    self.thread.join()
+    writers.remove(self)
+    self.reportError()
+
+  def syncDue(self):
+    if not self.unsynced:
+      return False
+    if self.sync == 'lines':
+      return self.unsynced >= self.sync_every
+    if self.sync == 'ms':
+      return (time.time() - self.last_sync) * 1000 >= self.sync_every
+    return False
+
+  def getTimeout(self):
+    """ How long the thread can wait for more lines before a sync is due
+    """
+    if self.sync != 'ms' or not self.unsynced:
+      return None
+    return max(0, self.last_sync + self.sync_every / 1000.0 - time.time())
+
+  def run(self):
+    closing = False
+    while not closing:
+      try:
+        items = [self.queue.get(timeout=self.getTimeout())]
+      except Queue.Empty:
+        items = []
+
+      try:
+        while len(items) < self.batch_size:
+          items.append(self.queue.get_nowait())
+      except Queue.Empty:
+        pass
+
+      lines = []
+      waiting = []
+      fsync = False
+      for item in items:
+        if item is None:
+          closing = True
+          fsync = True
+        elif isinstance(item, tuple):
+          if item[0]:
+            waiting.append(item[0])
+          fsync |= item[1]
+        else:
+          lines.append(item)
+
+      self.writeLines(lines, fsync or closing or self.syncDue())
+      for done in waiting:
+        done.set()
+
+    self.file.close()
+
+  def writeLines(self, lines, fsync):
+    try:
+      if lines:
+        self.file.write(''.join(lines))
+        self.file.flush()
+        self.unsynced += len(lines)
+      if fsync and self.unsynced:
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.time()
+    except (IOError, OSError) as e:
+      # Keep draining the queue so that the reactor is never blocked. Logging
+      # isn't thread safe so the error is reported by the reactor thread.
+      if not self.error:
+        self.error = e
+        reactor.callFromThread(self.reportError)
+
+  def reportError(self):
+    """ Log the first error writing the file, if it hasn't been already. Also
+      called by flush() and close() in case the reactor isn't running.
+    """
+    if self.error and not self.error_reported:
+      self.error_reported = True
+      log_warning("failed to write log file %s: %s", self.filename, self.error)
+
+
+def syncLogWriters(critical=False):
+  """ Called when a test error is reported. Writers which sync on errors are
+    asked to sync, and all writers are synced before returning if the error
+    is critical.
+  """
+  for writer in list(writers):
+    if critical:
+      writer.flush()
+    elif writer.sync == 'error':
+      writer.requestSync()
+
+def closeLogWriters():
+  for writer in list(writers):
+    writer.close()
+
+atexit.register(closeLogWriters)
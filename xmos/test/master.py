@@ -1,99 +1,262 @@
 from xmos.test.process import *
 from xmos.test.base import *
+from xmos.test.matcher import PatternMatcher
+from xmos.test.timer import TimerWheel
+from xmos.test.automaton import compileExpected
+import bisect
 
 class Master():
-  def __init__(self):
+  def __init__(self, clock=None, compile=False, session=None):
+    """ clock:   provides seconds() and callLater() for the Expected timeouts.
+            Defaults to the clock set in base, normally the reactor.
+        compile: check lines using the compiled form of each expected (see
+            automaton.py) rather than by walking the tree.
+        session: the session whose processes the master drives. Defaults to
+            the current session (see session.py).
+    """
+    self.session = session or getSession()
+
+    # Map of process name to the processes of the session
+    self.processes = self.session.processes
+
+    self.clock = clock or getClock()
+    self.compile = compile
     self.timeout = None
     self.deferred = None
-    self.expected = []
     self.nextExpected = []
 
+    # All Expected timeouts are driven by one reactor timer
+    self.timers = TimerWheel(self.clock)
+
+    # Map of process name to the matcher for all active Expected on that process
+    self.matchers = {}
+
+    # Map of expected index to the Expected leaves registered with the matchers
+    self.activeEvents = {}
+
+    # Map of process name to a count of the changes to its active Expected. Used
+    # to know when history that has already been checked needs checking again.
+    self.versions = {}
+
+    # Map of process name to the number of active Expected with a completion
+    # function. These can change their result without the Expected changing.
+    self.volatile = {}
+
+    self.setExpected([])
+
+  def setExpected(self, expected):
+    """ Set the list of expected values and build the dispatch index which maps
+      each process name to the indexes of the expected that wait on it.
+    """
+    for i in self.activeEvents.keys():
+      self.updateActiveEvents(i, [])
+
+    if self.compile:
+      expected = [ compileExpected(e) for e in expected ]
+    self.expected = expected
+
+    # Map of expected index to the processes it was dispatched for
+    self.active = {}
+    self.dispatch = {}
+
+    # Sorted indexes of the expected which have completed. These still track
+    # the lines received so that their history indexes move on.
+    self.completed = []
+    for (i,e) in enumerate(expected):
+      processes = e.getProcesses()
+      self.active[i] = processes
+      for process in processes:
+        self.dispatch.setdefault(process, []).append(i)
+      self.updateActiveEvents(i)
+
+  def updateActiveEvents(self, i, events=None):
+    """ Bring the matchers up to date with the Expected leaves that are active
+      in one of the expected. Called whenever the expected has changed.
+    """
+    if events is None:
+      events = self.expected[i].getActiveEvents() if i in self.active else []
+    new = set(events)
+    old = self.activeEvents.pop(i, set())
+
+    for event in old - new:
+      self.matchers[event.process].remove(event.regex)
+      self.eventChanged(event, -1)
+
+    for event in new - old:
+      if event.process not in self.matchers:
+        self.matchers[event.process] = PatternMatcher()
+      event.matcher = self.matchers[event.process]
+      event.matcher.add(event.regex)
+      self.eventChanged(event, 1)
+
+    if new:
+      self.activeEvents[i] = new
+
+  def eventChanged(self, event, delta):
+    self.versions[event.process] = self.getVersion(event.process) + 1
+    if event.completionFn:
+      self.volatile[event.process] = self.volatile.get(event.process, 0) + delta
+
+  def getVersion(self, process):
+    return self.versions.get(process, 0)
+
+  def completeExpected(self, i):
+    """ Remove an expected from the dispatch index once it has completed
+    """
+    for process in self.active.pop(i):
+      self.dispatch[process].remove(i)
+      if process in self.processes:
+        self.processes[process].dropHistoryCursor(i)
+    bisect.insort(self.completed, i)
+
+    # Need to keep something so that the indexes are not changed
+    self.expected[i] = AllOf([])
+
   def printState(self, message):
+    # Rendering every expected is expensive so only do it when it will be seen
+    if not log_enabled('debug'):
+      return
+
     # Add a blank line before
     log_debug("")
 
     log_debug(message)
     for (i,e) in enumerate(self.expected):
       log_debug("%d: Indexes %s" % (i,
-            ", ".join(["%s:%s" % (p, activeProcesses[p].getHistoryIndex(i)) for p in e.getProcesses()])))
+            ", ".join(["%s:%s" % (p, self.processes[p].getHistoryIndex(i)) for p in e.getProcesses()])))
       log_debug("%s" % e)
 
     # Add a blank line after
     log_debug("")
 
-  def checkReceived(self, process, string):
+  def checkReceived(self, process, string, position=None):
     """ Check one process and string against the expected values,
-      remove it if found.
+      remove it if found. The position of the string in the process
+      history is used to move on the history indexes.
     """
     assert self.expected
-    result = ExpectedResult(completed=True)
-    nextExpected = []
-    consumed = False
-    for (i,e) in enumerate(self.expected):
-      if consumed:
-        result.completed = False
-        nextExpected += [e]
-
-      else:
-        eventResult = e.completes(process, string)
-        result.started |= eventResult.started
-        result.timedout |= eventResult.timedout
-
-        if eventResult.consume:
-          # Only allow one process to match this string
-          activeProcesses[process].consume(string)
-          consumed = True
-
-        if (eventResult.completed or eventResult.started) and process in activeProcesses:
-          activeProcesses[process].moveHistoryIndex(i, string)
-
-        if eventResult.completed:
-          # Need to keep something so that the indexes are not changed
-          nextExpected += [AllOf([])]
-        else:
-          result.completed = False
-          nextExpected += [e]
-
-    if result.completed:
-      self.expected = []
+    started = timedout = False
+
+    # Only visit the expected that are waiting on this process
+    if process == ANY_PROCESS:
+      indexes = sorted(self.active)
+    elif self.completed and process in self.processes:
+      indexes = sorted(self.dispatch.get(process, []) + self.completed)
     else:
-      self.expected = nextExpected
+      indexes = list(self.dispatch.get(process, []))
+
+    # A line which matches an active Expected can change the active Expected
+    # of its expected without completing or starting it, such as a NoneOf
+    # which is seen in a Sequence
+    matched = False
+    if indexes and process in self.matchers:
+      matched = bool(self.matchers[process].getMatches(string))
+
+    for i in indexes:
+      if i not in self.active:
+        self.processes[process].moveHistoryIndex(i, string, position)
+        continue
+
+      e = self.expected[i]
+      eventResult = e.completes(process, string)
+      started |= eventResult.started
+      timedout |= eventResult.timedout
+
+      if (eventResult.completed or eventResult.started) and process in self.processes:
+        self.processes[process].moveHistoryIndex(i, string, position)
 
-    if result.completed or result.started:
+      if eventResult.consume:
+        # Only allow one process to match this string
+        self.processes[process].consume(string, position)
+
+      if eventResult.completed:
+        self.completeExpected(i)
+
+      if eventResult.completed or eventResult.started or eventResult.timedout or matched or process == ANY_PROCESS:
+        self.updateActiveEvents(i)
+
+      if eventResult.consume:
+        break
+
+    completed = not self.active
+    if completed:
+      self.setExpected([])
+
+    if completed or started:
       self.printState("Events remaining:")
 
-    return result
+    return getResult(completed, started, timedout)
 
   def checkAgainstHistory(self):
     """ Check through the existing process data history to
       see whether the expected has already been seen.
+
+      Each expected keeps a cursor into the history of each process it is
+      waiting on. Lines before the cursor have already been checked and are
+      only checked again once the active Expected for that process change.
     """
     changed = True
     while changed:
       changed = False
-      for (i,e) in enumerate(self.expected):
+      # Each pass goes through the expected as they were when it started, so
+      # one that completes during the pass still has the rest of its history
+      # checked, which can move on the others
+      for (i,e) in enumerate(list(self.expected)):
         for process in e.getProcesses():
-          for data in activeProcesses[process].getExpectHistory(i):
-            log_debug("checkAgainstHistory: %s: %s" % (process, data.strip()))
-            result = self.checkReceived(process, data)
+          p = self.processes[process]
+          version = self.getVersion(process)
+          generation = p.history_generation
+
+          # Start of the lines that have all been checked against this version
+          checked = p.getHistoryIndex(i)
+          start = checked
+          cursor = p.getHistoryCursor(i)
+          if cursor and cursor[0] == version and not self.volatile.get(process):
+            start = max(start, cursor[1])
+            self.skipHistory(p, checked, start)
+
+          for (position, data) in p.iterExpectHistory(i, start):
+            log_debug("checkAgainstHistory: %s: %s", process, data.strip())
+            result = self.checkReceived(process, data, position)
             changed |= result.started and not result.completed
             if not self.expected:
               return
 
+            if p.history_generation != generation:
+              # The history has been modified so the position is no longer valid
+              continue
+
+            if self.getVersion(process) != version:
+              version = self.getVersion(process)
+              checked = position + 1
+            elif p.getHistoryIndex(i) >= checked:
+              p.setHistoryCursor(i, version, position + 1)
+
+  def skipHistory(self, p, start, end):
+    """ Lines which are skipped by checkAgainstHistory would still have moved on
+      the history indexes of the completed expected.
+    """
+    if start >= end or not self.completed:
+      return
+
+    for (position, data) in p.output_history.view(start, end):
+      for i in self.completed:
+        p.moveHistoryIndex(i, data, position)
+
   def clearExpectHistory(self, process):
-    activeProcesses[process].clearExpectHistory()
+    self.processes[process].clearExpectHistory()
 
   def addExpected(self, expected):
     if expected:
       self.nextExpected += [expected]
 
   def startNext(self):
-    self.expected = self.nextExpected
+    self.setExpected(self.nextExpected)
     self.nextExpected = []
 
   def expect(self, expected=None):
     if expected:
-      self.expected = [expected]
+      self.setExpected([expected])
 
     # If there is nothing to expect then just continue
     if not self.expected:
@@ -108,37 +271,75 @@ class Master():
     if not self.expected:
       return self.expected
 
-    for e in self.expected:
-      e.registerTimeouts(self)
+    # Those already completed from the history have nothing left to time out
+    for i in sorted(self.active):
+      self.expected[i].registerTimeouts(self)
 
     # Create a deferred to return while we wait
     self.deferred = Deferred()
     return self.deferred
 
+  def setClock(self, clock):
+    """ Change the clock used for Expected timeouts. There must be no
+      timeouts pending.
+    """
+    assert not self.timers.getPendingCount()
+    self.clock = clock
+    self.timers = TimerWheel(clock)
+
+  def getPendingTimers(self):
+    """ Returns the number of Expected timeouts waiting to fire
+    """
+    return self.timers.getPendingCount()
+
   def sendLine(self, process, command):
-    activeProcesses[process].sendLine(command)
+    self.processes[process].sendLine(command)
 
-  def receive(self, process, string):
+  def receive(self, process, string, position=None):
     if self.expected:
-      result = self.checkReceived(process, string)
+      result = self.checkReceived(process, string, position)
       if result.started and not result.completed:
         self.checkAgainstHistory()
 
     if not self.expected:
       self.callDeferred()
 
+  def receiveMany(self, process, lines):
+    """ Receive all the complete lines from one read of a process. Each line
+      is recorded by the process and checked in turn, exactly as if it had
+      been passed to receive(), but the deferred is only resolved when an
+      expected completes rather than being checked after every line.
+    """
+    p = self.processes[process]
+    with self.session:
+      for line in lines:
+        position = p.recordLine(line)
+        if not self.expected:
+          continue
+
+        result = self.checkReceived(process, line, position)
+        if result.started and not result.completed:
+          self.checkAgainstHistory()
+
+        if not self.expected:
+          self.callDeferred()
+
   def timedOut(self, done):
     """ We've seen one timeout, clear all other pending ones and continue
     """
     assert self.expected
 
+    # A timed out Expected reacts to lines from any process
+    for process in self.processes:
+      self.versions[process] = self.getVersion(process) + 1
+
     if done:
       for e in self.expected:
         e.cancelTimeouts()
       self.callDeferred()
     else:
       # Check for valid timeouts having completed all transactions
-      self.checkReceived('invalid', 'invalid')
+      self.checkReceived(ANY_PROCESS, ANY_PROCESS)
       if not self.expected:
         self.callDeferred()
 
@@ -147,7 +348,7 @@ class Master():
       can't be called again
     """
     remaining = self.expected
-    self.expected = []
+    self.setExpected([])
 
     if self.deferred:
       d = self.deferred
@@ -155,8 +356,7 @@ class Master():
       d.callback(remaining)
 
   def killAllActive(self):
-    global activeProcesses
-    for (n, p) in activeProcesses.iteritems():
+    for (n, p) in self.processes.iteritems():
       try:
         p.kill()
       except:
@@ -164,8 +364,7 @@ class Master():
         pass
 
   def interruptAllActive(self):
-    global activeProcesses
-    for (n, p) in activeProcesses.iteritems():
+    for (n, p) in self.processes.iteritems():
       try:
         p.interrupt()
       except:
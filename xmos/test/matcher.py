@@ -0,0 +1,206 @@
+import re
+from xmos.test.base import LiteralPattern, PatternCache
+
+""" Combines many patterns into a small number of regular expressions so that
+    a line which matches none of them, as most lines don't, only needs to be
+    scanned once.
+
+    The patterns are joined into a single alternation with an empty named
+    group after each one:
+
+      (?:pattern0)(?P<p0>)|(?:pattern1)(?P<p1>)|...
+
+    and a line that the alternation doesn't find can't match any of the
+    patterns. When it does find a match the name of the last group to match
+    gives the pattern. The groups are empty so that they are only entered once
+    a pattern has matched, which keeps the scan of other lines as quick as
+    without them. The alternation only reports the first pattern to match
+    at the leftmost position, so the line is then searched again from that
+    position with an alternation of the patterns not yet found, until none of
+    them match. Plain string patterns are escaped and join the alternation.
+
+    Patterns are the compiled objects returned by base.compilePattern(). The
+    alternations have a cache of their own rather than sharing the pattern
+    cache, which they would push the patterns of expected values out of. The
+    slot of a pattern doesn't change while it is in a chunk, so once a line
+    has completed the expected waiting on a pattern the alternation without
+    it has usually been compiled already.
+"""
+
+# Python 2.7 limits a regular expression to 100 groups
+MAX_GROUPS = 99
+
+# Bounds the patterns in each alternation
+MAX_PATTERNS = 32
+
+# The compiled alternations, kept apart from the patterns of expected values
+_alternations = PatternCache(size=256)
+
+# Patterns that change meaning when embedded in a larger expression, or that
+# name a group which another pattern could also name
+_uncombinable = re.compile(r'\\[1-9]|\(\?P[=<]|\(\?[iLmsux]')
+
+def canCombine(pattern):
+  if isinstance(pattern, LiteralPattern):
+    return True
+  return not pattern.flags and not _uncombinable.search(pattern.pattern)
+
+def getSource(pattern):
+  """ The regular expression to embed in an alternation for a pattern
+  """
+  if isinstance(pattern, LiteralPattern):
+    return re.escape(pattern.pattern)
+  return pattern.pattern
+
+
+class _Chunk(object):
+  """ A group of patterns that are compiled into one regular expression, each
+    followed by a group named after its slot in the chunk.
+  """
+  def __init__(self):
+    self.slots = [None] * MAX_PATTERNS
+    self.slot_of = {}
+    self.groups = 0
+    self.regexes = {}
+
+  def __len__(self):
+    return len(self.slot_of)
+
+  def isFull(self, pattern):
+    return (len(self.slot_of) >= MAX_PATTERNS or
+            self.groups + pattern.groups + 1 > MAX_GROUPS)
+
+  def add(self, pattern):
+    slot = self.slots.index(None)
+    self.slots[slot] = pattern
+    self.slot_of[pattern] = slot
+    self.groups += pattern.groups + 1
+    self.regexes = {}
+
+  def remove(self, pattern):
+    self.slots[self.slot_of.pop(pattern)] = None
+    self.groups -= pattern.groups + 1
+    self.regexes = {}
+
+  def getRegex(self, found):
+    """ The alternation of the patterns of the chunk whose slots aren't in
+      found, or None if there are none left
+    """
+    try:
+      return self.regexes[found]
+    except KeyError:
+      pass
+
+    alternatives = [ '(?:%s)(?P<p%d>)' % (getSource(pattern), slot)
+                     for (slot, pattern) in enumerate(self.slots)
+                     if pattern is not None and slot not in found ]
+    regex = _alternations.compile('|'.join(alternatives)) if alternatives else None
+    if len(self.regexes) >= MAX_PATTERNS:
+      self.regexes.clear()
+    self.regexes[found] = regex
+    return regex
+
+  def match(self, string, found):
+    slots = frozenset()
+    m = self.getRegex(slots).search(string)
+    while m:
+      slot = int(m.lastgroup[1:])
+      found.add(self.slots[slot])
+      slots = slots.union((slot,))
+      regex = self.getRegex(slots)
+      if not regex:
+        break
+      m = regex.search(string, m.start())
+
+
+class PatternMatcher(object):
+  """ Tracks a changing set of patterns and finds all those that match a line,
+    ruling out most lines in a single pass. Patterns are reference counted so
+    that the same pattern can be added by several expected values.
+
+    Adding or removing a pattern only causes the chunk containing it to be
+    recompiled, and that only happens when the next line is matched.
+  """
+  def __init__(self):
+    self.counts = {}
+    self.chunks = []
+    self.chunk_of = {}
+    self.separate = set()
+    self.last_string = None
+    self.last_found = None
+
+  def __contains__(self, pattern):
+    return pattern in self.counts
+
+  def __len__(self):
+    return len(self.counts)
+
+  def getCounts(self):
+    literals = len([ p for p in self.counts if isinstance(p, LiteralPattern) ])
+    return { 'patterns' : len(self.counts), 'literals' : literals,
+             'combined' : len(self.chunk_of), 'chunks' : len(self.chunks),
+             'separate' : len(self.separate) }
+
+  def add(self, pattern):
+    count = self.counts.get(pattern, 0)
+    self.counts[pattern] = count + 1
+    if count:
+      return
+
+    self.last_string = None
+    if not canCombine(pattern):
+      self.separate.add(pattern)
+      return
+
+    chunk = self.chunks[-1] if self.chunks else None
+    if not chunk or chunk.isFull(pattern):
+      self.chunks.append(_Chunk())
+    self.chunks[-1].add(pattern)
+    self.chunk_of[pattern] = self.chunks[-1]
+
+  def remove(self, pattern):
+    count = self.counts[pattern] - 1
+    if count:
+      self.counts[pattern] = count
+      return
+
+    del self.counts[pattern]
+    self.last_string = None
+    if pattern in self.separate:
+      self.separate.remove(pattern)
+      return
+
+    chunk = self.chunk_of.pop(pattern)
+    chunk.remove(pattern)
+    if not len(chunk):
+      self.chunks.remove(chunk)
+
+  def match(self, string):
+    """ Returns the set of patterns which match the string.
+    """
+    found = set()
+    for chunk in self.chunks:
+      chunk.match(string, found)
+    for pattern in self.separate:
+      if pattern.search(string):
+        found.add(pattern)
+    return found
+
+  def getMatches(self, string):
+    """ Returns the set of patterns which match the string. The whole set of
+      patterns is matched once per line and the result kept for the other
+      calls with the same line.
+    """
+    if string is not self.last_string:
+      self.last_found = self.match(string)
+      self.last_string = string
+
+    return self.last_found
+
+  def matches(self, pattern, string):
+    """ Returns whether one pattern matches the string.
+    """
+    if pattern not in self.counts:
+      return bool(pattern.search(string))
+
+    return pattern in self.getMatches(string)
@@ -0,0 +1,207 @@
+import os
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, returnValue
+from xmos.test.base import *
+from xmos.test.process import XrunProcess
+
+""" A pool of endpoint processes which are kept running between tests.
+
+    Starting an endpoint with xrun means loading, booting and waiting for it
+    to be ready, which takes seconds per device. A test can instead lease an
+    endpoint from the pool and return it when done, so that the next test
+    needing the same endpoint running the same command line gets the booted
+    process:
+
+      ep0 = yield pool.lease('ep0', ['xrun', '--id', '0', 'app.xe'])
+      ...
+      pool.release(ep0)
+
+    A pool holds at most one process per endpoint name. Leasing an endpoint
+    with a different command line stops the process that is running.
+
+    When an idle process is leased it is first reset: the reset command is
+    sent and the acknowledgement expected. A process which doesn't acknowledge
+    the reset is stopped and a new one started. A new process is leased once
+    its ready pattern has been seen.
+
+    A process is healthy while it is running and none of its error patterns
+    have matched since it was last reset. Unhealthy processes are stopped
+    when they are released or found idle.
+
+    A leased process is moved to the master of the test and added to the
+    processes of its session. If the session completes first (see
+    session.py) the process is released then.
+"""
+
+class Reset(object):
+  """ The protocol which brings an endpoint back to a clean state between
+    tests: command is sent with sendLine and the pattern must be seen
+    within timeout seconds.
+  """
+  def __init__(self, command, pattern, timeout=10):
+    self.command = command
+    self.pattern = pattern
+    self.timeout = timeout
+
+
+@withrepr(lambda x: "%s" % x.__name__)
+def resetTimeout(process, pattern, timeout, errorFn, critical=None):
+  """ A reset which isn't acknowledged isn't an error, the process is
+    replaced
+  """
+  log_info("%s: reset not acknowledged in %.1f seconds" % (process, timeout))
+  return True
+
+def spawnProcess(process, command):
+  reactor.spawnProcess(process, command[0], command, env=os.environ)
+
+
+class EndpointPool(object):
+  def __init__(self, reset=None, ready=None, ready_timeout=60,
+               processClass=XrunProcess, spawn=spawnProcess, **kwargs):
+    """ reset:        the Reset protocol, or None to reuse processes as they are
+        ready:        pattern seen once a new process is ready to use
+        processClass: the Process class created, with kwargs
+        spawn:        called with the process and command line to start the
+                      program
+    """
+    self.reset = reset
+    self.ready = ready
+    self.ready_timeout = ready_timeout
+    self.processClass = processClass
+    self.spawn = spawn
+    self.kwargs = kwargs
+
+    # Map of endpoint name to (command, process) of the processes in the pool
+    self.processes = {}
+
+    # Map of endpoint name to the leased process, or None while it is starting
+    self.leased = {}
+
+    # Map of endpoint name to the error pattern matches when last reset
+    self.error_matches = {}
+
+    # Holds the idle processes
+    self.session = Session('pool')
+
+    self.counts = { 'started' : 0, 'reused' : 0, 'reset_failed' : 0, 'unhealthy' : 0 }
+
+  @inlineCallbacks
+  def lease(self, name, command, master=None):
+    """ Returns a deferred fired with a running process for the endpoint
+      name running command. The process uses master, by default the master
+      of the current session.
+    """
+    if name in self.leased:
+      raise ValueError("%s is already leased" % name)
+    master = master or getSession().getMaster()
+    command = list(command)
+
+    self.leased[name] = None
+    try:
+      process = self.takeIdle(name, command, master)
+      if process and self.reset:
+        reset = yield self.resetProcess(process, master)
+        if not reset:
+          self.counts['reset_failed'] += 1
+          self.stop(name)
+          process = None
+
+      if process:
+        self.counts['reused'] += 1
+      else:
+        process = yield self.start(name, command, master)
+    except:
+      del self.leased[name]
+      raise
+
+    self.leased[name] = process
+    self.error_matches[name] = process.error_matches
+
+    session = master.session
+    session.shared.add(name)
+    session.getDeferred().addCallback(self.sessionCompleted, process)
+    returnValue(process)
+
+  def release(self, process):
+    """ Return a leased process to the pool, or stop it if it isn't healthy
+    """
+    name = process.name
+    if self.leased.get(name) is not process:
+      return
+    del self.leased[name]
+
+    if not self.isHealthy(process):
+      log_info("%s: stopping unhealthy process" % name)
+      self.counts['unhealthy'] += 1
+      self.stop(name)
+    else:
+      process.setMaster(self.session.getMaster())
+
+  def sessionCompleted(self, session, process):
+    self.release(process)
+    return session
+
+  def isHealthy(self, process):
+    return not process.ended and process.error_matches == self.error_matches.get(process.name)
+
+  def takeIdle(self, name, command, master):
+    """ Returns the idle process for name running command moved to master,
+      or None once any other process for name has been stopped
+    """
+    if name not in self.processes:
+      return None
+
+    (running, process) = self.processes[name]
+    if running != command:
+      log_info("%s: stopping to run %s" % (name, " ".join(command)))
+      self.stop(name)
+      return None
+
+    if not self.isHealthy(process):
+      log_info("%s: stopping unhealthy process" % name)
+      self.counts['unhealthy'] += 1
+      self.stop(name)
+      return None
+
+    process.setMaster(master)
+    return process
+
+  @inlineCallbacks
+  def resetProcess(self, process, master):
+    """ Returns a deferred fired with whether the reset was acknowledged.
+      The history is cleared afterwards so the test starts clean.
+    """
+    expected = Expected(process.name, self.reset.pattern, self.reset.timeout, func=resetTimeout)
+    master.sendLine(process.name, self.reset.command)
+    yield master.expect(expected)
+    process.clearExpectHistory()
+    returnValue(not expected.timedout)
+
+  @inlineCallbacks
+  def start(self, name, command, master):
+    log_info("%s: starting %s" % (name, " ".join(command)))
+    process = self.processClass(name, master, **self.kwargs)
+    self.processes[name] = (command, process)
+    self.counts['started'] += 1
+    self.spawn(process, command)
+
+    if self.ready:
+      yield master.expect(Expected(name, self.ready, self.ready_timeout))
+    returnValue(process)
+
+  def stop(self, name):
+    """ Stop the process for name and remove it from the pool
+    """
+    (command, process) = self.processes.pop(name)
+    processes = process.master.session.processes
+    if processes.get(name) is process:
+      del processes[name]
+    try:
+      process.kill()
+    except:
+      # process already ended
+      pass
+
+  def getCounts(self):
+    return dict(self.counts)
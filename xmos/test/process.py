@@ -5,6 +5,9 @@ import re
 import os
 import datetime
 from xmos.test.base import *
+from xmos.test.history import History
+from xmos.test.log_writer import LogWriter
+from xmos.test.matcher import PatternMatcher
 from xmos.test.xmos_logging import *
 
 def chomp(s):
@@ -13,8 +16,94 @@ def chomp(s):
   return s.rstrip('\n')
 
 
+class LineFramer(object):
+  """ Splits the data received from a process into lines. Each chunk of data
+    is only scanned once and incomplete lines are kept as a list of pieces
+    until their newline arrives.
+
+    As with str.splitlines() a lone carriage return also ends a line, but
+    only lines ending in a newline are returned so text overwritten using
+    carriage returns (e.g. progress bars) is discarded.
+
+    Lines longer than max_line_length are split, with a newline added to
+    each piece but the last.
+  """
+  def __init__(self, max_line_length=None):
+    self.max_line_length = max_line_length
+    self.partial = []
+    self.partial_length = 0
+    self.bytes = 0
+    self.lines = 0
+    self.split_lines = 0
+
+  def feed(self, data):
+    """ Returns the list of complete lines
+    """
+    self.bytes += len(data)
+    lines = []
+
+    # A carriage return is only kept when it could be followed by a newline
+    if self.partial and self.partial[-1][-1] == '\r' and data[:1] != '\n':
+      self.clearPartial()
+
+    segments = data.splitlines(True)
+    last = len(segments) - 1
+    for (i, segment) in enumerate(segments):
+      if segment[-1] == '\n':
+        if self.partial:
+          segment = ''.join(self.partial) + segment
+          self.clearPartial()
+        self.addLine(segment, lines)
+
+      elif i != last:
+        # Overwritten by a carriage return
+        self.clearPartial()
+
+      else:
+        self.partial.append(segment)
+        self.partial_length += len(segment)
+        if self.max_line_length and self.partial_length > self.max_line_length:
+          self.splitPartial(lines)
+
+    return lines
+
+  def clearPartial(self):
+    self.partial = []
+    self.partial_length = 0
+
+  def splitPartial(self, lines):
+    """ Force out the parts of an incomplete line which are too long
+    """
+    data = ''.join(self.partial)
+    length = self.max_line_length
+    end = len(data) - len(data) % length
+    if data[-1] == '\r' and end == len(data):
+      end -= length
+    for start in xrange(0, end, length):
+      self.addLine(data[start:start + length] + '\n', lines, split=True)
+    self.partial = [data[end:]] if end < len(data) else []
+    self.partial_length = len(data) - end
+
+  def addLine(self, line, lines, split=False):
+    length = self.max_line_length
+    if length and len(line.rstrip('\r\n')) > length:
+      body = line.rstrip('\r\n')
+      ending = line[len(body):]
+      for start in xrange(0, len(body) - length, length):
+        lines.append(body[start:start + length] + '\n')
+        self.split_lines += 1
+      line = body[start + length:] + ending
+    elif split:
+      self.split_lines += 1
+    lines.append(line)
+    self.lines += 1
+
+  def getCounts(self):
+    return { 'bytes' : self.bytes, 'lines' : self.lines, 'split_lines' : self.split_lines,
+             'pending_bytes' : self.partial_length }
+
+
 class Process(protocol.ProcessProtocol):
-  full_line = ''
 
   def __init__(self, name, master, errorFn=testError,
                criticalErrors=None, **kwargs):
@@ -24,38 +113,85 @@ class Process(protocol.ProcessProtocol):
     self.master = master
     self.send_new_line = kwargs.get('send_new_line', '\r\n')
 
-    # History of all lines received from this process - can be cleared by master
-    self.output_history = []
+    # Lines longer than max_line_length are split
+    self.framer = LineFramer(kwargs.get('max_line_length'))
+
+    # History of all lines received from this process - can be cleared by master.
+    # The lines held in memory can be limited to history_window bytes, with
+    # lines that are still needed spilled to the history_spill file. Without
+    # a spill file only lines no expected can read are dropped, so the window
+    # isn't kept to while no expected is live (see getHistoryMemory).
+    self.output_history = History(window=kwargs.get('history_window'),
+                                  spill=kwargs.get('history_spill'),
+                                  floor=self.getHistoryFloor)
 
     # Map of expected index to current index into the history
     self.history_indexes = {}
 
+    # Map of expected index to the master's (version, index) up to which the
+    # history has been checked. The generation is incremented when the history
+    # is cleared so that the master knows indexes have moved.
+    self.history_cursors = {}
+    self.history_generation = 0
+
     self.error_patterns = set()
+    self.error_matcher = PatternMatcher()
+
+    # Number of times an error pattern has matched
+    self.error_matches = 0
     self.output_file = None
     self.errorFn = errorFn
     self.criticalErrors = criticalErrors
 
+    # Set once the program has ended
+    self.ended = False
+
+    # The process log is written by a background thread. output_sync chooses
+    # how often it is synced to disk (see log_writer).
     if 'output_file' in kwargs:
-      self.output_file = open(kwargs['output_file'], 'w')
+      self.output_file = LogWriter(kwargs['output_file'],
+                                   sync=kwargs.get('output_sync', 'error'),
+                                   sync_every=kwargs.get('output_sync_every'))
+
+    # Ensure there are no two processes created with the same name in a session
+    processes = master.session.processes
+    assert self.name not in processes
 
-    # Ensure there are no two processes created with the same name
-    assert self.name not in activeProcesses
+    processes[self.name] = self
 
-    activeProcesses[self.name] = self
+  def setMaster(self, master):
+    """ Move the process to another master, for example that of the next test
+      in a suite (see suite.py). The history is cleared so that the new master
+      only sees the lines output from now on.
+    """
+    processes = master.session.processes
+    assert self.name not in processes
+
+    session = self.master.session
+    if session.processes.get(self.name) is self:
+      del session.processes[self.name]
+    processes[self.name] = self
+    self.master = master
+    self.clearExpectHistory()
+    session.release()
 
-  def log(self, message, level='debug'):
-    """ Log to the process log and to the full log.
+  def log(self, message, level='debug', action=False):
+    """ Log to the process log and to the full log. Actions of the framework,
+      rather than lines received from the process, are marked with a leading
+      '# ' in the process log so that they can be told apart (see replay.py).
     """
+    to_log = level is not None and log_enabled(level)
+    if not to_log and not self.output_file:
+      return
+
     now = datetime.datetime.now()
-    if level is not None:
+    if to_log:
       eval('log_%s' % level)("%s: %s: %s" % (now.time(), self.name, message.strip()))
     if self.output_file:
-      self.output_file.write("%s: %s\n" % (now.time(), message.strip()))
-      self.output_file.flush()
-      os.fsync(self.output_file.fileno())
+      self.output_file.write("%s%s: %s\n" % ('# ' if action else '', now.time(), message.strip()))
 
   def connectionMade(self):
-    self.log("connection made\n")
+    self.log("connection made\n", action=True)
 
   def inConnectionLost(self):
     log_debug("%s: stdin is closed!" % self.name)
@@ -73,109 +209,169 @@ class Process(protocol.ProcessProtocol):
       log_debug("%s: process exited, no exit code" % (self.name))
 
   def processEnded(self, reason):
+    self.ended = True
     if reason.value.exitCode:
       log_debug("%s: process ended, status %d" % (self.name, reason.value.exitCode))
     else:
       log_debug("%s: process ended, no exit code" % (self.name))
+    self.master.session.release()
 
   def outReceived(self, data):
     self.errReceived(data)
 
   def errReceived(self, data):
+    lines = self.framer.feed(data)
+    if lines:
+      self.master.receiveMany(self.name, lines)
 
-    newlines_and_oldlines = self.full_line + data
-
-    lines = newlines_and_oldlines.splitlines(True)
-
-    for i, line in enumerate(lines):
-      if line.endswith('\n'):
-        self.log(line)
-        self.output_history.append(line)
-
-        # Need to check error pattern before calling master as the master may change
-        # the active error patterns
-        self.checkErrorPatterns(line)
-
-        self.master.receive(self.name, line)
+  def recordLine(self, line):
+    """ Log and store a line received from the process before the master
+      checks it. Returns the position of the line in the history.
+    """
+    self.log(line)
+    position = self.output_history.append(line)
 
-        # If the last line in the list ends with a newline, we do not need to carry over
-        # any output to the next comparison
-        if (i == len(lines)-1):
-          self.full_line = ''
+    # Need to check error pattern before calling master as the master may change
+    # the active error patterns
+    self.checkErrorPatterns(line)
+    return position
 
-      elif i == len(lines)-1:
-        self.full_line += lines[-1]
+  def getReceivedCounts(self):
+    """ Returns a dictionary of the bytes and lines received from the process
+    """
+    return self.framer.getCounts()
 
   def getHistoryIndex(self, expect_index):
     return self.history_indexes.get(expect_index, 0)
 
+  def getHistoryFloor(self):
+    """ Returns the lowest history position that any expected can still read.
+      An expected which hasn't matched anything yet reads the whole history,
+      and so can the next expect when none is live.
+    """
+    if not self.master.active:
+      return 0
+    for i in range(len(self.master.expected)):
+      if i not in self.history_indexes:
+        return 0
+    return min(self.history_indexes.values())
+
+  def getHistoryMemory(self):
+    """ Returns a dictionary with the current and peak number of bytes of
+      history held in memory along with the lines held, dropped and spilled,
+      and the number of lines received while over the history window.
+    """
+    return self.output_history.getMemory()
+
   def setHistoryIndex(self, expect_index, history_index):
     self.history_indexes[expect_index] = history_index
 
-  def getExpectHistory(self, expect_index):
-    """ Build up a copy so that there are no iteration issues
-       when the history is pruned by a process checking the
-      history.
-    """
-    history_index = self.getHistoryIndex(expect_index)
-    return [h for h in self.output_history[history_index:]]
+  def getHistoryCursor(self, expect_index):
+    return self.history_cursors.get(expect_index)
+
+  def setHistoryCursor(self, expect_index, version, history_index):
+    self.history_cursors[expect_index] = (version, history_index)
 
-  def moveHistoryIndex(self, expect_index, data):
-    """ Return index of entry after matching entry
+  def dropHistoryCursor(self, expect_index):
+    self.history_cursors.pop(expect_index, None)
+
+  def iterExpectHistory(self, expect_index, start=0):
+    """ Iterate over the (position, line) of the history not yet seen by an
+      expected, up to the end of the history when it is called. Lines which
+      are consumed while iterating are skipped when they are reached, except
+      after the history has evicted lines as the view keeps the lines from
+      before the eviction.
+    """
+    history_index = max(self.getHistoryIndex(expect_index), start)
+    return self.output_history.view(history_index)
+
+  def getExpectHistory(self, expect_index, start=0):
+    return (line for (position, line) in self.iterExpectHistory(expect_index, start))
+
+  def moveHistoryIndex(self, expect_index, data, position=None):
+    """ Move the index of an expected on to the entry after the first entry
+      at or after the index which is the same as the matching entry. That is
+      normally the matching entry itself, so its position should be given
+      when known as the search then stops there, but an earlier copy of the
+      line moves the index only as far as that copy.
     """
     history_index = self.getHistoryIndex(expect_index)
-    history = self.output_history[history_index:]
-    if data in history:
-      self.setHistoryIndex(expect_index, history_index + history.index(data) + 1)
-    else:
+    end = None
+    if position >= history_index and self.output_history.lineAt(position, data):
+      end = position + 1
+    position = self.output_history.find(data, history_index, end)
+
+    if position is None:
       self.setHistoryIndex(expect_index, len(self.output_history))
+    else:
+      self.setHistoryIndex(expect_index, max(history_index, position + 1))
 
-  def consume(self, string):
-    log_debug("%s: consume '%s'" % (self.name, string))
-    # Remove the matching string closest to the end of the output
-    self.output_history.reverse()
-    # The string should be in the list, so don't ignore the exception
-    self.output_history.remove(string)
-    self.output_history.reverse()
+  def consume(self, string, position=None):
+    """ Remove a line from the history so that no other expected can match it.
+      The position of the line should be given when known, otherwise the
+      matching line closest to the end of the output is removed.
+    """
+    log_debug("%s: consume '%s'", self.name, string)
+    if not self.output_history.lineAt(position, string):
+      position = self.output_history.rfind(string)
+
+    # The string should be in the history, so don't ignore it being missing
+    if position is None:
+      raise ValueError("%s: consumed line not in history: '%s'" % (self.name, string))
+
+    self.output_history.remove(position)
 
   def clearExpectHistory(self):
     """ Clear the entire history of values seen
     """
-    self.log("CLEAR HISTORY", level=None)
-    self.output_history[:] = []
+    self.log("CLEAR HISTORY", level=None, action=True)
+    self.output_history.clear()
     self.history_indexes = {}
+    self.history_cursors = {}
+    self.history_generation += 1
 
   def sendLine(self, command):
     """ Send a given command to a process
     """
-    self.log("send: '%s'" % command, level='info')
+    self.log("send: '%s'" % command, level='info', action=True)
     self.transport.write(command + self.send_new_line)
 
   def checkErrorPatterns(self, data):
-    for (pattern, errorFn, critical) in self.error_patterns:
-      if matchesPattern(pattern, data):
+    if not self.error_patterns:
+      return
+
+    found = self.error_matcher.match(data)
+    for (pattern, regex, errorFn, critical) in self.error_patterns:
+      if regex in found:
+        self.error_matches += 1
         errorFn("found %s: %s" % (self.name, data), critical=critical)
 
-  def registerErrorPattern(self, pattern, errorFn=None, critical=None):
+  def registerErrorPattern(self, pattern, errorFn=None, critical=None, literal=False):
     if errorFn is None:
       errorFn = self.errorFn
     if critical is None:
       critical = self.criticalErrors
     log_debug("%s: registering error pattern '%s'" % (self.name, pattern))
-    self.error_patterns.add((pattern, errorFn, critical))
+    regex = compilePattern(pattern, literal)
+    entry = (pattern, regex, errorFn, critical)
+    if entry not in self.error_patterns:
+      self.error_patterns.add(entry)
+      self.error_matcher.add(regex)
     self.printErrorPatterns()
 
   def unregisterErrorPattern(self, pattern):
     """ Remove error patterns which match the specified pattern
     """
     log_debug("%s: unregistering error pattern '%s'" % (self.name, pattern))
-    self.error_patterns = set([ (p,e,c) for (p,e,c) in self.error_patterns if p != pattern ])
+    for entry in [ (p,r,e,c) for (p,r,e,c) in self.error_patterns if p == pattern ]:
+      self.error_patterns.remove(entry)
+      self.error_matcher.remove(entry[1])
     self.printErrorPatterns()
 
   def printErrorPatterns(self):
     prefix = "\n  %s: " % self.name
-    log_debug("%s: error patterns now:%s%s" % (self.name, prefix,
-         prefix.join([ p for (p,e,c) in self.error_patterns ])))
+    log_debug(lambda: "%s: error patterns now:%s%s" % (self.name, prefix,
+         prefix.join([ p for (p,r,e,c) in self.error_patterns ])))
 
   def kill(self):
     self.transport.signalProcess('KILL')
@@ -0,0 +1,237 @@
+import json
+import time
+
+""" Opt-in counters for finding where a test spends its time matching lines.
+
+    Enabling the profiler wraps the methods it measures, so nothing is added
+    to the line path while it is disabled. Once enabled it records:
+
+      - for each expected, keyed by process and pattern: the number of lines
+        it was checked against, the number it matched and the time spent
+        matching. Patterns are matched together per line, so the time for
+        the combined match is charged to the first expected checked.
+      - for each process, in every session: the lines and bytes received and
+        the time spent checking error patterns. Processes outside the default
+        session are named after their session as well.
+      - for the master: the time spent checking received lines and the time
+        spent checking the history. Lines checked from the history are only
+        counted in the history time.
+      - the lag between a read from a process arriving and each of its lines
+        being checked by the master, and how late the reactor runs a timer
+        that is set every sample_interval seconds. The reactor is not
+        sampled when running in virtual time.
+
+    The counters are written as JSON by base.testComplete or dump().
+
+    Enable with the --profile option of base.getParser() or by calling
+    enable() before the test starts.
+"""
+
+class Timings(object):
+  """ Count, total and maximum of a set of durations, with a histogram of
+    powers of two microseconds to give the distribution.
+  """
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.buckets = {}
+
+  def add(self, seconds):
+    self.count += 1
+    self.total += seconds
+    if seconds > self.max:
+      self.max = seconds
+    bucket = 1
+    us = seconds * 1e6
+    while bucket < us:
+      bucket <<= 1
+    self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+  def toDict(self):
+    return { 'count' : self.count, 'total_s' : self.total, 'max_s' : self.max,
+             'mean_s' : self.total / self.count if self.count else 0,
+             'histogram_us' : dict((str(b), n) for (b, n) in sorted(self.buckets.items())) }
+
+
+class Profiler(object):
+  def __init__(self, filename=None, sample_interval=0.1):
+    self.filename = filename
+    self.sample_interval = sample_interval
+
+    # Map of (process, pattern) to [evaluations, matches, seconds]
+    self.expected = {}
+
+    # Map of process to [error pattern checks, seconds]
+    self.error_patterns = {}
+
+    self.check_received = Timings()
+    self.check_history = Timings()
+    self.dispatch_lag = Timings()
+    self.reactor_lag = Timings()
+
+    # Map of process name to when its last read arrived
+    self.arrivals = {}
+    self.in_history = 0
+    self.originals = []
+    self.sampler = None
+    self.started = time.time()
+
+  def wrap(self, cls, name, wrapper):
+    original = getattr(cls, name)
+    self.originals.append((cls, name, original))
+    setattr(cls, name, wrapper(original))
+
+  def install(self):
+    import xmos.test.base as base
+    import xmos.test.master as master
+    import xmos.test.process as process
+    profiler = self
+
+    def matchesLine(original):
+      def wrapper(expected, process, string):
+        start = time.time()
+        matched = original(expected, process, string)
+        elapsed = time.time() - start
+        if process == expected.process:
+          counts = profiler.expected.setdefault((expected.process, expected.pattern), [0, 0, 0.0])
+          counts[0] += 1
+          counts[1] += bool(matched)
+          counts[2] += elapsed
+        return matched
+      return wrapper
+
+    def errReceived(original):
+      def wrapper(p, data):
+        profiler.arrivals[p.name] = time.time()
+        return original(p, data)
+      return wrapper
+
+    def checkErrorPatterns(original):
+      def wrapper(p, data):
+        start = time.time()
+        original(p, data)
+        counts = profiler.error_patterns.setdefault(p, [0, 0.0])
+        counts[0] += 1
+        counts[1] += time.time() - start
+      return wrapper
+
+    def checkReceived(original):
+      def wrapper(m, process, string, position=None):
+        start = time.time()
+        if not profiler.in_history and process in profiler.arrivals:
+          profiler.dispatch_lag.add(start - profiler.arrivals[process])
+        result = original(m, process, string, position)
+        if not profiler.in_history:
+          profiler.check_received.add(time.time() - start)
+        return result
+      return wrapper
+
+    def checkAgainstHistory(original):
+      def wrapper(m):
+        start = time.time()
+        profiler.in_history += 1
+        try:
+          return original(m)
+        finally:
+          profiler.in_history -= 1
+          if not profiler.in_history:
+            profiler.check_history.add(time.time() - start)
+      return wrapper
+
+    self.wrap(base.Expected, 'matchesLine', matchesLine)
+    self.wrap(process.Process, 'errReceived', errReceived)
+    self.wrap(process.Process, 'checkErrorPatterns', checkErrorPatterns)
+    self.wrap(master.Master, 'checkReceived', checkReceived)
+    self.wrap(master.Master, 'checkAgainstHistory', checkAgainstHistory)
+
+    # Lag only means something when the clock is the reactor
+    clock = base.getClock()
+    if self.sample_interval and not isinstance(clock, base.VirtualClock):
+      self.sample(clock)
+
+  def sample(self, clock):
+    """ Measure how late the reactor runs a timer
+    """
+    due = clock.seconds() + self.sample_interval
+    def fired():
+      self.reactor_lag.add(max(0, clock.seconds() - due))
+      self.sample(clock)
+    self.sampler = clock.callLater(self.sample_interval, fired)
+
+  def uninstall(self):
+    for (cls, name, original) in reversed(self.originals):
+      setattr(cls, name, original)
+    self.originals = []
+    if self.sampler and self.sampler.active():
+      self.sampler.cancel()
+    self.sampler = None
+
+  def getCounters(self):
+    from xmos.test.session import getSessions, defaultSession
+
+    # The processes of every session, along with those of sessions which have
+    # completed and are no longer tracked but received lines
+    all_processes = set(self.error_patterns)
+    for session in getSessions():
+      all_processes.update(session.processes.values())
+
+    processes = {}
+    for p in all_processes:
+      session = p.master.session
+      name = p.name if session is defaultSession else "%s: %s" % (session.name, p.name)
+      counts = p.getReceivedCounts()
+      (checks, seconds) = self.error_patterns.get(p, (0, 0.0))
+      processes[name] = { 'lines' : counts['lines'], 'bytes' : counts['bytes'],
+                          'error_pattern_checks' : checks, 'error_pattern_s' : seconds }
+
+    expected = [ { 'process' : process, 'pattern' : pattern, 'evaluations' : evaluations,
+                   'matches' : matches, 'regex_s' : seconds }
+                 for ((process, pattern), (evaluations, matches, seconds))
+                 in sorted(self.expected.items(), key=lambda item: -item[1][2]) ]
+
+    return { 'elapsed_s' : time.time() - self.started,
+             'master' : { 'check_received' : self.check_received.toDict(),
+                          'check_against_history' : self.check_history.toDict() },
+             'dispatch_lag' : self.dispatch_lag.toDict(),
+             'reactor_lag' : self.reactor_lag.toDict(),
+             'processes' : processes,
+             'expected' : expected }
+
+
+# The profiler while one is enabled
+profiler = None
+
+def enable(filename=None, sample_interval=0.1):
+  """ Start recording. The counters are written to filename when the test
+    completes.
+  """
+  global profiler
+  if profiler:
+    disable()
+  profiler = Profiler(filename, sample_interval)
+  profiler.install()
+  return profiler
+
+def disable():
+  global profiler
+  if profiler:
+    profiler.uninstall()
+    profiler = None
+
+def enabled():
+  return profiler is not None
+
+def getCounters():
+  return profiler.getCounters() if profiler else None
+
+def dump(filename=None):
+  """ Write the counters as JSON to filename, or to the file given to enable()
+  """
+  if not profiler:
+    return
+  filename = filename or profiler.filename
+  if not filename:
+    return
+  with open(filename, 'w') as f:
+    json.dump(profiler.getCounters(), f, indent=2, sort_keys=True)
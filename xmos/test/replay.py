@@ -0,0 +1,132 @@
+import heapq
+import re
+from twisted.internet import reactor
+import xmos.test.base as base
+import xmos.test.process as process
+import xmos.test.profiler as profiler
+from xmos.test.xmos_logging import *
+
+""" Replays the console logs written by Process(output_file=...) through a
+    test so that its expectations can be checked without any hardware.
+
+    Each log entry is "<time>: <message>". Entries for lines received from a
+    process are fed to a replay process of the same name, in the order of
+    their times across all of the logs. The entries for the test's own
+    actions (connection made, send, CLEAR HISTORY) start with '# ' and are
+    skipped as the test performs them again. Leading and trailing whitespace
+    is not kept by the logs so is not replayed.
+
+    By default the replay runs in virtual time: time jumps straight to the
+    next line or timeout so a long run replays in seconds. With realtime set
+    the lines are fed with their original relative timing using the reactor.
+"""
+
+# An entry, marked with '# ' when it was logged by Process itself rather
+# than received from the process
+_entry = re.compile(r'^(# )?(\d+):(\d\d):(\d\d(?:\.\d+)?): ?(.*)$')
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+def parseConsoleLog(filename):
+  """ Returns a list of (seconds, message, received) for the entries in a
+    console log, where received is set for the lines received from the
+    process. The times are seconds since the start of the day the log started.
+  """
+  entries = []
+  day = 0
+  last = None
+  with open(filename) as f:
+    for line in f:
+      m = _entry.match(line.rstrip('\r\n'))
+      if not m:
+        continue
+
+      (action, hours, minutes, seconds, message) = m.groups()
+      when = int(hours) * 3600 + int(minutes) * 60 + float(seconds) + day
+
+      # The log only records the time of day
+      if last is not None and when < last - SECONDS_PER_DAY / 2:
+        day += SECONDS_PER_DAY
+        when += SECONDS_PER_DAY
+      last = when
+
+      entries.append((when, message, not action))
+  return entries
+
+
+class ReplayTransport(object):
+  """ Stands in for the transport of a spawned process. Anything the test
+    sends to the process is discarded.
+  """
+  def write(self, data):
+    pass
+
+  def loseConnection(self):
+    pass
+
+  def signalProcess(self, signal):
+    pass
+
+
+class Replay(object):
+  """ Feeds recorded console logs to a test.
+
+    master:   the master used by the test
+    logs:     map of process name to the console log to replay for it
+    realtime: feed the lines with their original timing instead of in
+              virtual time
+    processClass: the class of the processes created, so that they register
+              the same error patterns as the live processes
+  """
+  def __init__(self, master, logs, realtime=False, processClass=process.Process, **kwargs):
+    self.master = master
+    self.realtime = realtime
+    self.processes = {}
+    for (name, filename) in sorted(logs.iteritems()):
+      p = processClass(name, master, **kwargs)
+      p.transport = ReplayTransport()
+      self.processes[name] = p
+
+    # Merge the logs in time order, keeping the order of each log. Time is
+    # measured from the first entry, normally when the first process started.
+    logs = [ [ (when, i, seq, name, message, received)
+               for (seq, (when, message, received)) in enumerate(parseConsoleLog(filename)) ]
+             for (i, (name, filename)) in enumerate(sorted(logs.iteritems())) ]
+    entries = list(heapq.merge(*logs))
+    self.start_time = entries[0][0] if entries else 0
+    self.entries = [ (when - self.start_time, name, message)
+                     for (when, i, seq, name, message, received) in entries if received ]
+
+    if not realtime:
+      # The clock is put back once the replay has finished
+      self.previous_clock = base.getClock()
+      self.clock = base.VirtualClock()
+      base.setClock(self.clock)
+      master.setClock(self.clock)
+
+  def feed(self, name, message):
+    self.processes[name].errReceived(message + '\n')
+
+  def start(self, testFunction, args):
+    """ Run the test against the logs, in place of base.testStart
+    """
+    log_debug("replay: %d lines from %s", len(self.entries), ', '.join(sorted(self.processes)))
+    if self.realtime:
+      for (when, name, message) in self.entries:
+        reactor.callLater(when, self.feed, name, message)
+      base.testStart(testFunction, args)
+      return
+
+    if getattr(args, 'profile', None):
+      profiler.enable(args.profile)
+
+    try:
+      testFunction(args)
+      for (when, name, message) in self.entries:
+        self.clock.advanceTo(when)
+        self.feed(name, message)
+
+      # Let any remaining sleeps and timeouts run
+      self.clock.runUntilIdle()
+    finally:
+      base.setClock(self.previous_clock)
@@ -0,0 +1,236 @@
+import json
+from xmos.test.base import *
+from xmos.test.process import XrunProcess
+from xmos.test.pool import spawnProcess
+
+""" Runs tests in parallel on the devices that are available, giving each
+    test exclusive use of the devices it runs on.
+
+    When two test runs race for the same hardware xrun fails with errors like
+    "xrun: No available devices". The scheduler instead holds an inventory of
+    the devices, each an endpoint on an xTAG adapter, and only starts a test
+    once every device it requires is free:
+
+      inventory = Inventory()
+      inventory.addDevice('ep0', 'A1B2C3', tags=['avb'])
+      inventory.addDevice('ep1', 'D4E5F6', tags=['avb'])
+
+      scheduler = Scheduler(inventory)
+      scheduler.addTest('talker', runTalker, requires=['avb'])
+      scheduler.addTest('pair', runPair, requires=['avb', 'avb'])
+      sessions = scheduler.run(args)
+
+    A requirement is the name of a device or a tag, and each is met by a
+    different device. Tests are started in the order they were added, but a
+    test whose devices are free is started ahead of one still waiting, so as
+    many tests run at once as the devices allow. A test whose requirements
+    the inventory can never meet fails without running.
+
+    Each test runs in its own session (see session.py) and is called with
+    args and the list of devices allocated to it, in the order of its
+    requirements. startXrun() starts xrun on a device with its adapter id.
+    A test's devices are freed once it has completed and every process it
+    started has ended. Once every test has completed the utilisation of the
+    devices is logged and the reactor is stopped.
+
+    The inventory can be loaded from a JSON file:
+
+      { "xrun" : ["xrun"],
+        "devices" : [ { "name" : "ep0", "adapter" : "A1B2C3", "tags" : ["avb"] } ] }
+
+    Giving a stub script as xrun lets the scheduling be tried without any
+    hardware (see self_test/scheduler_1).
+"""
+
+class Device(object):
+  def __init__(self, name, adapter_id, tags=()):
+    self.name = name
+    self.adapter_id = adapter_id
+    self.tags = set(tags)
+
+  def matches(self, requirement):
+    return requirement == self.name or requirement in self.tags
+
+  def __repr__(self):
+    return "Device(%s, %s)" % (self.name, self.adapter_id)
+
+
+class Inventory(object):
+  def __init__(self, xrun=('xrun',)):
+    """ xrun: the command line used to run xrun
+    """
+    self.xrun = list(xrun)
+    self.devices = []
+
+  def addDevice(self, name, adapter_id, tags=()):
+    assert name not in [ d.name for d in self.devices ]
+    device = Device(name, adapter_id, tags)
+    self.devices.append(device)
+    return device
+
+  def getCommand(self, device, args):
+    """ The xrun command line to run args on device
+    """
+    return self.xrun + ['--adapter-id', device.adapter_id] + list(args)
+
+  def allocate(self, requires, busy=()):
+    """ Returns a device which isn't busy for each requirement, or None if
+      the requirements can't all be met at once
+    """
+    devices = [ d for d in self.devices if d.name not in busy ]
+
+    def search(i, used):
+      if i == len(requires):
+        return []
+      for device in devices:
+        if device.name not in used and device.matches(requires[i]):
+          rest = search(i + 1, used | set([device.name]))
+          if rest is not None:
+            return [device] + rest
+      return None
+
+    return search(0, set())
+
+  @classmethod
+  def load(cls, filename):
+    with open(filename) as f:
+      config = json.load(f)
+    inventory = cls(config.get('xrun', ['xrun']))
+    for d in config['devices']:
+      inventory.addDevice(d['name'], d['adapter'], d.get('tags', []))
+    return inventory
+
+
+class Scheduler(object):
+  def __init__(self, inventory, timeout=None):
+    """ timeout: seconds after which a test which hasn't completed fails
+    """
+    self.inventory = inventory
+    self.timeout = timeout
+    self.tests = []
+
+    # Tests waiting for devices, as (session, testFunction, requires)
+    self.queue = []
+
+    # Map of device name to the session using it
+    self.busy = {}
+
+    # Map of device name to the seconds it has been in use
+    self.busy_time = dict((d.name, 0.0) for d in inventory.devices)
+
+    # Map of test name to the seconds it waited for devices
+    self.waits = {}
+
+    self.running = 0
+    self.peak_running = 0
+    self.sessions = []
+    self.started = None
+    self.finished = None
+
+  def addTest(self, name, testFunction, requires):
+    self.tests.append((name, testFunction, list(requires)))
+
+  def run(self, args):
+    """ Run every test and stop the reactor. Returns the session of each test,
+      in the order of the tests.
+    """
+    runReactor(lambda: self.startTests(args), args)
+    return self.sessions
+
+  def startTests(self, args):
+    self.args = args
+    self.started = getClock().seconds()
+    for (name, testFunction, requires) in self.tests:
+      session = Session(name)
+      self.sessions.append(session)
+      if self.inventory.allocate(requires) is None:
+        session.call(testError, "requires %s which the inventory can't provide" % ", ".join(requires))
+        session.complete()
+      else:
+        self.queue.append((session, testFunction, requires))
+    self.schedule()
+
+  def schedule(self):
+    """ Start every waiting test whose devices are free
+    """
+    for entry in list(self.queue):
+      if entry not in self.queue:
+        # Started when a test completed as soon as it was started
+        continue
+      (session, testFunction, requires) = entry
+      devices = self.inventory.allocate(requires, self.busy)
+      if devices is not None:
+        self.queue.remove(entry)
+        self.startTest(session, testFunction, devices)
+
+    if not self.running and not self.queue and self.finished is None:
+      self.finished = getClock().seconds()
+      with defaultSession:
+        self.logUtilisation()
+      sessionsComplete(self.sessions)
+
+  def startTest(self, session, testFunction, devices):
+    now = getClock().seconds()
+    self.waits[session.name] = now - self.started
+    for device in devices:
+      self.busy[device.name] = session
+    self.running += 1
+    self.peak_running = max(self.peak_running, self.running)
+
+    session.call(log_info, "Starting on %s" % ", ".join(d.name for d in devices))
+    timer = None
+    if self.timeout:
+      timer = getClock().callLater(self.timeout, session.call, self.testTimedOut, session)
+    session.getDeferred().addCallback(self.testCompleted, timer)
+    session.getReleased().addCallback(self.testReleased, devices, now)
+    session.start(lambda args: testFunction(args, devices), self.args)
+
+  def testTimedOut(self, session):
+    testError("test did not complete within %.1f seconds" % self.timeout)
+    session.complete()
+
+  def testCompleted(self, session, timer):
+    if timer and timer.active():
+      timer.cancel()
+    return session
+
+  def testReleased(self, session, devices, start):
+    """ The processes of a test are killed when it completes, so its devices
+      are only free once they have all ended
+    """
+    elapsed = getClock().seconds() - start
+    for device in devices:
+      del self.busy[device.name]
+      self.busy_time[device.name] += elapsed
+    self.running -= 1
+    self.schedule()
+    return session
+
+  def startXrun(self, device, args, master=None, **kwargs):
+    """ Start xrun running args on device. Returns the XrunProcess, which is
+      named after the device.
+    """
+    master = master or getSession().getMaster()
+    process = XrunProcess(device.name, master, **kwargs)
+    spawnProcess(process, self.inventory.getCommand(device, args))
+    return process
+
+  def getUtilisation(self):
+    """ Returns the proportion of the time each device was in use, along
+      with the peak number of tests running and the mean wait for devices
+    """
+    end = self.finished if self.finished is not None else getClock().seconds()
+    elapsed = end - self.started if self.started is not None else 0
+    return { 'elapsed_s' : elapsed,
+             'peak_running' : self.peak_running,
+             'mean_wait_s' : sum(self.waits.values()) / len(self.waits) if self.waits else 0,
+             'devices' : dict((name, busy / elapsed if elapsed else 0)
+                              for (name, busy) in self.busy_time.items()) }
+
+  def logUtilisation(self):
+    utilisation = self.getUtilisation()
+    log_info("Ran %d tests in %.1f seconds, at most %d at once, waiting %.1f seconds on average" % (
+        len(self.waits), utilisation['elapsed_s'], utilisation['peak_running'], utilisation['mean_wait_s']))
+    for device in self.inventory.devices:
+      log_info("  %s (%s): %.0f%% in use" % (device.name, device.adapter_id,
+          utilisation['devices'][device.name] * 100))
@@ -0,0 +1,186 @@
+from twisted.internet import defer
+import xmos.test.xmos_logging as xmos_logging
+
+""" Sessions allow several tests to run at once in one reactor.
+
+    A session holds the state which is otherwise global to a test: the
+    processes it has started, its master, its error and warning counts and
+    its logging context. Code running on behalf of a session runs inside it:
+
+      with session:
+        ...
+
+    While a session is current the logging prefix and indent are its own and
+    the errors and warnings logged are added to its counts as well as to the
+    overall counts. The master enters its session for each read from a process
+    and each timeout, and base.sleep() resumes a test in the session which
+    slept, so a test written with @inlineCallbacks stays in its session.
+
+    The default session is current when no other is. It holds the global
+    process registry (base.activeProcesses) and the overall counts, so a test
+    started with base.testStart() runs exactly as it would without sessions.
+"""
+
+class Session(object):
+  def __init__(self, name=None, counts=None, processes=None):
+    self.name = name
+
+    # Map of process name to the processes started in this session
+    self.processes = {} if processes is None else processes
+    self.master = None
+
+    # Names of the processes lent to the session, which are left running
+    # when it completes (see suite.py)
+    self.shared = set()
+
+    # Number of calls to base.testError and the errors and warnings logged
+    self.error_count = 0
+    self.counts = counts if counts is not None else { 'errors' : 0, 'warnings' : 0 }
+
+    # Logging context, swapped into xmos_logging while the session is current
+    self.log_prefix = "%s: " % name if name else ''
+    self.log_indent = ''
+
+    # Depth of the debug logging of the expected (see base.log_completes_start)
+    self.completes_indent = 1
+
+    self.completed = False
+    self.deferred = defer.Deferred()
+
+    # Fired once the session has completed and all its processes have ended
+    self.released = defer.Deferred()
+
+    # The sessions which were current when this one was entered
+    self.outer = []
+    _sessions.append(self)
+
+  def __enter__(self):
+    self.outer.append(_current)
+    if _current is not self:
+      _switch(self)
+    return self
+
+  def __exit__(self, *exc_info):
+    outer = self.outer.pop()
+    if outer is not self:
+      _switch(outer)
+    return False
+
+  def call(self, fn, *args, **kwargs):
+    """ Call fn inside the session. Used to wrap callbacks from the reactor.
+    """
+    with self:
+      return fn(*args, **kwargs)
+
+  def getMaster(self, **kwargs):
+    """ Returns the master of the session, creating it with kwargs on first use
+    """
+    if self.master is None:
+      from xmos.test.master import Master
+      self.master = Master(session=self, **kwargs)
+    return self.master
+
+  def start(self, testFunction, args):
+    """ Run testFunction(args) in the session. The test should call
+      base.testComplete() when it is done. A test which raises an exception
+      is failed and completed.
+    """
+    with self:
+      d = defer.maybeDeferred(testFunction, args)
+    d.addErrback(self.fail)
+    return d
+
+  def fail(self, failure):
+    with self:
+      self.error_count += 1
+      xmos_logging.log_error("%s: %s" % (failure.type.__name__, failure.getErrorMessage()))
+      xmos_logging.log_debug(failure.getTraceback)
+    self.complete()
+
+  def complete(self):
+    """ Print the summary of the session, stop its processes and fire the
+      deferred returned by getDeferred(). Has no effect once the session has
+      completed.
+    """
+    if self.completed:
+      return
+    self.completed = True
+
+    with self:
+      xmos_logging.print_status_summary(self.counts)
+      if self.master:
+        for e in self.master.expected:
+          e.cancelTimeouts()
+        self.master.setExpected([])
+        for (name, p) in self.processes.items():
+          if name in self.shared:
+            continue
+          try:
+            p.kill()
+          except:
+            # process already ended
+            pass
+    self.deferred.callback(self)
+    self.release()
+
+  def release(self):
+    """ Stop tracking a completed session once none of its processes are
+      running, closing their histories as testShutdown would have. Called
+      again whenever one of its processes ends or is handed back.
+    """
+    if not self.completed or self not in _sessions:
+      return
+    for p in self.processes.values():
+      if p.transport and not p.ended:
+        return
+    for p in self.processes.values():
+      p.output_history.close()
+    _sessions.remove(self)
+    self.released.callback(self)
+
+  def getDeferred(self):
+    """ Returns a deferred fired with the session when it completes
+    """
+    return self.deferred
+
+  def getReleased(self):
+    """ Returns a deferred fired with the session once it has completed and
+      none of its processes are running, so that what they used is free
+    """
+    return self.released
+
+  def passed(self):
+    return self.completed and not self.counts['errors']
+
+  def getSummary(self):
+    return { 'name' : self.name, 'passed' : self.passed(), 'errors' : self.counts['errors'],
+             'warnings' : self.counts['warnings'] }
+
+  def __repr__(self):
+    return "Session(%s)" % (self.name or 'default')
+
+
+def _switch(session):
+  """ Make session current, saving the logging context of the current session
+  """
+  global _current
+  _current.log_indent = xmos_logging.indent
+  xmos_logging.indent = session.log_indent
+  xmos_logging.prefix = session.log_prefix
+  xmos_logging.session_counts = session.counts
+  _current = session
+
+# The sessions which may have processes running, so that they can all be
+# shut down
+_sessions = []
+
+defaultSession = Session(counts=xmos_logging.counts)
+_current = defaultSession
+
+def getSession():
+  """ Returns the current session
+  """
+  return _current
+
+def getSessions():
+  return list(_sessions)
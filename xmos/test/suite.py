@@ -0,0 +1,164 @@
+from twisted.internet import reactor
+from twisted.internet import defer
+from twisted.internet.defer import inlineCallbacks
+from twisted.python import failure
+from xmos.test.base import *
+
+""" Runs a suite of tests one after another in a single run of the reactor.
+
+    The reactor can't be restarted, so running each test with base.testStart
+    means a new interpreter, and new endpoint processes, for every test. A
+    suite instead runs each test in its own session (see session.py), so each
+    has its own master, error counts and pass/fail summary, while endpoints
+    that are still needed are kept running from one test to the next:
+
+      suite = Suite(setUp=resetEndpoints)
+      suite.addEndpoint('ep0', startEp0)
+      suite.addTest('connect', testConnect)
+      suite.addTest('stream', testStream, tearDown=stopStream)
+      sessions = suite.run(args)
+
+    An endpoint is started by a function called with the master of the test
+    that first needs it, which creates the Process with that master, spawns
+    the program and returns the Process. Before each test the endpoints are
+    lent to the session of the test, with their history cleared, and started
+    again if they have ended. After the test they are restarted according to
+    their policy:
+
+      RESTART_NEVER:      only if the program has ended
+      RESTART_ON_FAILURE: also when the test failed
+      RESTART_ALWAYS:     after every test
+
+    The setUp and tearDown hooks of the suite are called around every test,
+    inside those of the test. Hooks and tests are called with args and can
+    return a deferred. Each test calls base.testComplete() when it is done.
+    A test isn't run if its endpoints can't be started or setUp fails, and
+    errors in tearDown fail the test.
+"""
+
+RESTART_NEVER = 'never'
+RESTART_ON_FAILURE = 'failure'
+RESTART_ALWAYS = 'always'
+
+class Endpoint(object):
+  def __init__(self, name, start, restart):
+    self.name = name
+    self.start = start
+    self.restart = restart
+    self.process = None
+
+    # Number of times the endpoint has been started
+    self.starts = 0
+
+  def isRunning(self):
+    return self.process is not None and not self.process.ended
+
+  def stop(self):
+    try:
+      self.process.kill()
+    except:
+      # process already ended
+      pass
+    self.process = None
+
+
+class Suite(object):
+  def __init__(self, setUp=None, tearDown=None, timeout=None):
+    """ setUp, tearDown: hooks called around every test
+        timeout: seconds after which a test which hasn't completed fails
+    """
+    self.setUp = setUp
+    self.tearDown = tearDown
+    self.timeout = timeout
+    self.tests = []
+    self.endpoints = []
+
+    # Holds the endpoints between tests
+    self.session = Session('suite')
+
+  def addEndpoint(self, name, start, restart=RESTART_ON_FAILURE):
+    """ start(master) creates the Process called name and starts its program
+    """
+    assert name not in [ e.name for e in self.endpoints ]
+    endpoint = Endpoint(name, start, restart)
+    self.endpoints.append(endpoint)
+    return endpoint
+
+  def addTest(self, name, testFunction, setUp=None, tearDown=None):
+    self.tests.append((name, testFunction, setUp, tearDown))
+
+  def getEndpoint(self, name):
+    for endpoint in self.endpoints:
+      if endpoint.name == name:
+        return endpoint
+    return None
+
+  def run(self, args):
+    """ Run every test and stop the reactor. Returns the session of each test,
+      in the order of the tests.
+    """
+    sessions = []
+    runReactor(lambda: self.runTests(args, sessions), args)
+    return sessions
+
+  @inlineCallbacks
+  def runTests(self, args, sessions):
+    for (name, testFunction, setUp, tearDown) in self.tests:
+      session = Session(name)
+      sessions.append(session)
+      yield self.runTest(session, testFunction, setUp, tearDown, args)
+    sessionsComplete(sessions)
+
+  @inlineCallbacks
+  def runTest(self, session, testFunction, setUp, tearDown, args):
+    try:
+      session.call(self.lendEndpoints, session)
+      for hook in [ h for h in (self.setUp, setUp) if h ]:
+        yield session.call(defer.maybeDeferred, hook, args)
+    except Exception:
+      session.fail(failure.Failure())
+
+    if not session.completed:
+      timer = None
+      if self.timeout:
+        timer = getClock().callLater(self.timeout, session.call, self.testTimedOut, session)
+      session.start(testFunction, args)
+      yield session.getDeferred()
+      if timer and timer.active():
+        timer.cancel()
+
+    for hook in [ h for h in (tearDown, self.tearDown) if h ]:
+      try:
+        yield session.call(defer.maybeDeferred, hook, args)
+      except Exception:
+        session.fail(failure.Failure())
+
+    session.call(self.reclaimEndpoints, session)
+
+  def testTimedOut(self, session):
+    testError("test did not complete within %.1f seconds" % self.timeout)
+    session.complete()
+
+  def lendEndpoints(self, session):
+    master = session.getMaster()
+    for endpoint in self.endpoints:
+      if endpoint.isRunning():
+        endpoint.process.setMaster(master)
+      else:
+        log_info("Starting %s" % endpoint.name)
+        endpoint.process = endpoint.start(master)
+        endpoint.starts += 1
+      session.shared.add(endpoint.name)
+
+  def reclaimEndpoints(self, session):
+    master = self.session.getMaster()
+    for endpoint in self.endpoints:
+      if not endpoint.isRunning():
+        endpoint.process = None
+      elif endpoint.restart == RESTART_ALWAYS:
+        endpoint.stop()
+      elif endpoint.restart == RESTART_ON_FAILURE and not session.passed():
+        log_info("Stopping %s after failure" % endpoint.name)
+        endpoint.stop()
+      else:
+        endpoint.process.setMaster(master)
@@ -0,0 +1,195 @@
+import math
+from twisted.internet import reactor
+from twisted.python import failure
+from xmos.test.xmos_logging import log_error, log_debug
+
+""" A hierarchical timer wheel which drives many timeouts from a single reactor
+    timer.
+
+    Time is divided into ticks of a fixed resolution. Level 0 of the wheel has
+    a slot for each of the next few ticks, and each higher level has slots
+    covering a whole turn of the level below it. Timers are added to the
+    lowest level that can hold them and are moved down a level (cascaded)
+    when the level below reaches their slot, so adding and cancelling a timer
+    never depends on how many timers there are.
+
+    Timers fire no earlier than requested and at most one tick late. Timers
+    due in the same tick fire in the order of their requested time. A timer
+    which raises an exception is logged as an error and the others still
+    fire.
+"""
+
+class WheelTimer(object):
+  """ A timer returned by TimerWheel.callLater(). Like the reactor's delayed
+    calls it can be cancelled and asked whether it is still active.
+  """
+  __slots__ = ('wheel', 'time', 'seq', 'fn', 'args', 'kwargs', 'due', 'slot')
+
+  def __init__(self, wheel, time, seq, fn, args, kwargs):
+    self.wheel = wheel
+    self.time = time
+    self.seq = seq
+    self.fn = fn
+    self.args = args
+    self.kwargs = kwargs
+    self.due = None
+    self.slot = None
+
+  def getTime(self):
+    return self.time
+
+  def active(self):
+    return self.slot is not None
+
+  def cancel(self):
+    """ Stop the timer from firing. Has no effect if it has already fired or
+      been cancelled.
+    """
+    if self.slot is not None:
+      self.wheel.remove(self)
+
+  def __repr__(self):
+    return "WheelTimer(%.3f, %s)" % (self.time, getattr(self.fn, '__name__', self.fn))
+
+
+class TimerWheel(object):
+  """ Schedules timers on a hierarchical wheel.
+
+    clock:      provides seconds() and callLater(), the reactor by default
+    resolution: length of a tick in seconds
+    bits:       each level has 2**bits slots
+    levels:     number of levels, timers further away wait in an overflow set
+  """
+  def __init__(self, clock=None, resolution=0.01, bits=6, levels=4):
+    self.clock = clock or reactor
+    self.resolution = resolution
+    self.bits = bits
+    self.mask = (1 << bits) - 1
+    self.levels = levels
+    self.wheels = [ [ set() for slot in range(1 << bits) ] for level in range(levels) ]
+    self.overflow = set()
+
+    # The time of tick 0 and the last tick that has been processed
+    self.start = None
+    self.tick = 0
+
+    self.pending = 0
+    self.seq = 0
+    self.call = None
+    self.wakeup = None
+
+  def __len__(self):
+    return self.pending
+
+  def getPendingCount(self):
+    return self.pending
+
+  def callLater(self, delay, fn, *args, **kwargs):
+    """ Call fn(*args, **kwargs) after delay seconds
+    """
+    now = self.clock.seconds()
+    if not self.pending:
+      # Restart the ticks so that there is nothing to catch up on
+      self.start = now
+      self.tick = 0
+
+    self.seq += 1
+    timer = WheelTimer(self, now + delay, self.seq, fn, args, kwargs)
+    timer.due = max(self.tick + 1, int(math.ceil((timer.time - self.start) / self.resolution)))
+    self.insert(timer)
+    self.pending += 1
+
+    # The reactor timer only needs to move if this timer is due before the
+    # next tick already scheduled
+    tick = min(timer.due, (self.tick | self.mask) + 1)
+    if not self.call or self.start + tick * self.resolution < self.wakeup:
+      self.setWakeup(tick)
+    return timer
+
+  def insert(self, timer):
+    for level in range(self.levels):
+      shift = self.bits * (level + 1)
+      if timer.due >> shift == self.tick >> shift:
+        timer.slot = self.wheels[level][(timer.due >> (self.bits * level)) & self.mask]
+        break
+    else:
+      timer.slot = self.overflow
+    timer.slot.add(timer)
+
+  def remove(self, timer):
+    timer.slot.remove(timer)
+    timer.slot = None
+    self.pending -= 1
+    if not self.pending and self.call:
+      self.call.cancel()
+      self.call = None
+
+  def schedule(self):
+    """ Make sure the reactor timer is set for the next tick that needs
+      processing.
+    """
+    if not self.pending:
+      return
+
+    # The next non-empty slot on level 0, or the next cascade
+    wheel = self.wheels[0]
+    tick = self.tick + 1
+    while tick & self.mask and not wheel[tick & self.mask]:
+      tick += 1
+    self.setWakeup(tick)
+
+  def setWakeup(self, tick):
+    if self.call:
+      self.call.cancel()
+    self.wakeup = self.start + tick * self.resolution
+    self.call = self.clock.callLater(max(0, self.wakeup - self.clock.seconds()), self.run)
+
+  def run(self):
+    self.call = None
+    now = self.clock.seconds()
+
+    # Timers fired can add timers which restart the ticks
+    while self.pending and self.start + (self.tick + 1) * self.resolution <= now:
+      self.advance()
+    self.schedule()
+
+  def advance(self):
+    """ Process the next tick: cascade any higher level slots that the tick
+      reaches and then fire the timers in the level 0 slot.
+    """
+    self.tick += 1
+    tick = self.tick
+
+    if not tick & self.mask:
+      # Count the levels whose index has wrapped round to 0
+      wrapped = 1
+      while wrapped < self.levels and not (tick >> (self.bits * wrapped)) & self.mask:
+        wrapped += 1
+      if wrapped == self.levels:
+        self.cascade(self.overflow)
+      for level in range(min(wrapped, self.levels - 1), 0, -1):
+        self.cascade(self.wheels[level][(tick >> (self.bits * level)) & self.mask])
+
+    slot = self.wheels[0][tick & self.mask]
+    if not slot:
+      return
+
+    timers = sorted(slot, key=lambda t: (t.time, t.seq))
+    for timer in timers:
+      # Timers can be cancelled by those that fire before them
+      if timer.slot is not slot:
+        continue
+      self.remove(timer)
+      try:
+        timer.fn(*timer.args, **timer.kwargs)
+      except Exception:
+        f = failure.Failure()
+        log_error("timer %s raised %s: %s" % (getattr(timer.fn, '__name__', timer.fn),
+            f.type.__name__, f.getErrorMessage()))
+        log_debug(f.getTraceback)
+
+  def cascade(self, slot):
+    timers = list(slot)
+    slot.clear()
+    for timer in timers:
+      self.insert(timer)
@@ -7,6 +7,10 @@ import os
 
     It also tracks error/warning counts and provides a standard configuration
     and reporting function.
+
+    Formatting is deferred until a message is known to be emitted. Messages
+    can be given with format arguments, log_debug('%s: %s', name, line), or
+    as a callable returning the message.
 """
 
 counts = {
@@ -14,6 +18,13 @@ counts = {
     'warnings' : 0
 }
 
+# The counts of the current session (see session.py). Errors and warnings are
+# added to these as well as to the overall counts when they differ.
+session_counts = counts
+
+# Prefix identifying the current session in each message
+prefix = ''
+
 indent_step = '    '
 indent = ''
 
@@ -26,19 +37,39 @@ def log_unindent():
     assert len(indent) >= len(indent_step)
     indent = indent[len(indent_step):]
 
-def log_error(message, exc_info=False):
-    logging.error('%sERROR: %s' % (indent, message), exc_info=exc_info)
+def log_enabled(level):
+    """ Returns whether messages at the given level ('debug', 'info', ...)
+        will be emitted.
+    """
+    return logging.getLogger().isEnabledFor(getattr(logging, level.upper()))
+
+def format_message(message, args):
+    if callable(message):
+        message = message()
+    if args:
+        message = message % args
+    return message
+
+def log_error(message, *args, **kwargs):
+    logging.error('%s%sERROR: %s' % (prefix, indent, format_message(message, args)),
+            exc_info=kwargs.get('exc_info', False))
     counts['errors'] += 1
+    if session_counts is not counts:
+        session_counts['errors'] += 1
 
-def log_warning(message):
-    logging.warning('%sWARNING: %s' % (indent, message))
+def log_warning(message, *args):
+    logging.warning('%s%sWARNING: %s' % (prefix, indent, format_message(message, args)))
     counts['warnings'] += 1
+    if session_counts is not counts:
+        session_counts['warnings'] += 1
 
-def log_info(message):
-    logging.info('%s%s' % (indent, message))
+def log_info(message, *args):
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logging.info('%s%s%s' % (prefix, indent, format_message(message, args)))
 
-def log_debug(message):
-    logging.debug('%s%s' % (indent, message))
+def log_debug(message, *args):
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug('%s%s%s' % (prefix, indent, format_message(message, args)))
 
 def configure_logging(level_console='INFO', level_file=None, filename='run.log', summary_filename=None):
     if level_file:
@@ -57,11 +88,15 @@ def configure_logging(level_console='INFO', level_file=None, filename='run.log',
     else:
         logging.basicConfig(level=eval('logging.%s' % level_console), format='%(message)s')
 
-def print_status_summary():
-    if counts['errors'] or counts['warnings']:
+def print_status_summary(totals=None):
+    """ Report the overall counts, or the counts given (e.g. of a session)
+    """
+    if totals is None:
+        totals = counts
+    if totals['errors'] or totals['warnings']:
         log_info('%d ERROR%s and %d WARNING%s detected' % (
-            counts['errors'], ('' if counts['errors'] == 1 else 'S'),
-            counts['warnings'], ('' if counts['warnings'] == 1 else 'S')))
+            totals['errors'], ('' if totals['errors'] == 1 else 'S'),
+            totals['warnings'], ('' if totals['warnings'] == 1 else 'S')))
     else:
       log_info("Test passed")
 